@@ -1,6 +1,12 @@
-from vfb_connect.cross_server_tools import VfbConnect
+from pipeline import Pipeline
 
-vc = VfbConnect()
+
+def connect():
+    from vfb_connect.cross_server_tools import VfbConnect
+    return VfbConnect()
+
+
+pipeline = Pipeline("apply_synonym_edges", connect)
 
 q = """
 MATCH (primary {short_form:'FBbt_00004225'})
@@ -40,5 +46,12 @@ FOREACH (x IN CASE WHEN unresolved THEN [1] ELSE [] END |
   SET r.unresolved_ref = unresolved_ref)
 """
 
-res = vc.nc.commit_list(statements=[q])
-print(res)
+
+@pipeline.step("Applying synonym edges to FBbt_00004225")
+def apply_synonym_edges():
+    res = pipeline.commit([q])
+    print(res)
+
+
+if __name__ == "__main__":
+    raise SystemExit(pipeline.main())
@@ -0,0 +1,163 @@
+import glob
+import gzip
+import heapq
+import os
+
+from executor import cypher_literal, cypher_string
+
+# Each change log line is 'kind<TAB>key':
+# node          - short_form of a node
+# node_id       - internal id of a node without a short_form
+# relationship  - internal id of a relationship
+# Relationships created by a statement have no id before it runs, so statements that
+# create them record the nodes at either end instead.
+CHANGESET = "changeset.tsv.gz"
+HEADER = "kind\tkey"
+EXPORT_BATCH_SIZE = 20000
+
+
+def capture_statement(read, variables, detached=()):
+    """
+    Build a read-only query returning the change log entries for what a statement is about to change.
+
+    Variables bound to anything other than a node or a relationship (strings, maps, nulls from
+    an OPTIONAL MATCH) are skipped, so every variable used by the write half can be passed.
+    Entries come back sorted and de-duplicated.
+
+    :param read: The read half of the statement, without RETURN.
+    :param variables: Variables bound by the read half that the write half uses.
+    :param detached: Node variables the write half removes with DETACH DELETE; their relationships
+                     and the neighbours losing them are recorded too.
+    """
+    names = ", ".join(variables)
+    entities = "[" + names + "]" + "".join(
+        f" + [({name})-[detached_rel]-(detached_nbr) | detached_rel]"
+        f" + [({name})-[detached_rel]-(detached_nbr) | detached_nbr]"
+        for name in detached
+    )
+    return (
+        f"{read} WITH {names} UNWIND {entities} AS x "
+        "WITH x, apoc.meta.cypher.type(x) AS cypher_type WHERE cypher_type IN ['NODE', 'RELATIONSHIP'] "
+        "RETURN DISTINCT CASE WHEN cypher_type = 'RELATIONSHIP' THEN 'relationship' "
+        "WHEN x.short_form IS NULL THEN 'node_id' ELSE 'node' END AS kind, "
+        "CASE WHEN cypher_type = 'NODE' AND x.short_form IS NOT NULL THEN x.short_form ELSE toString(id(x)) END AS key "
+        "ORDER BY kind, key"
+    )
+
+
+def read_entries(path):
+    """Stream the (kind, key) entries of a change log file, plain or gzipped, in file order."""
+    with (gzip.open(path, 'rt') if path.endswith('.gz') else open(path)) as f:
+        for line in f:
+            line = line.rstrip('\n')
+            if line and line != HEADER:
+                kind, _, key = line.partition('\t')
+                yield kind, key
+
+
+def write_merged(path, sources):
+    """
+    Merge sorted entry streams into a sorted, de-duplicated gzip file without holding them in memory.
+
+    :return: The number of entries written.
+    """
+    count = 0
+    previous = None
+    with gzip.open(path, 'wt') as f:
+        for entry in heapq.merge(*sources):
+            if entry != previous:
+                f.write("%s\t%s\n" % entry)
+                count += 1
+                previous = entry
+    return count
+
+
+class ChangeLog:
+    """
+    The nodes and relationships changed during one run, for incremental downstream reindexing.
+
+    Before each write the server exports the entries of its capture query, sorted and
+    de-duplicated, to the next part file of the step with apoc.export.csv.query, writing
+    them in batches. The directory must therefore be one the server writes to and the
+    scripts can read: a path relative to the Neo4j import directory they run from (see
+    the LOAD CSV steps). When a step finishes its parts are merged into <step>.tsv.gz, and
+    merge() combines the step files of the run into changeset.tsv.gz.
+    """
+
+    def __init__(self, directory):
+        """
+        :param directory: Directory the step files and the merged changeset are written to.
+        """
+        self.directory = directory
+        self.parts = []
+        self.files = []
+
+    def start(self, names):
+        """
+        Remove what an earlier run left in the directory, so it only ever holds the files of this run.
+
+        :param names: Names of every step of the pipeline, whether or not they run this time.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        stale = [os.path.join(self.directory, CHANGESET)]
+        for name in names:
+            stale.append(os.path.join(self.directory, name + ".tsv.gz"))
+            stale.extend(glob.glob(os.path.join(glob.escape(self.directory), glob.escape(name) + ".part*.tsv")))
+        for path in stale:
+            if os.path.exists(path):
+                os.remove(path)
+        self.parts = []
+        self.files = []
+
+    def export(self, nc, name, query, params=None):
+        """
+        Have the server write the (kind, key) rows of a capture query to the step's next part file.
+
+        :param nc: A Neo4jConnect instance (e.g. vc.nc).
+        :param name: Name of the step.
+        :param query: Query returning kind and key columns (see capture_statement).
+        :param params: Dict of values available to the query as $parameters.
+        :return: False if the export failed, True otherwise.
+        """
+        path = os.path.join(self.directory, "%s.part%d.tsv" % (name, len(self.parts)))
+        config = "delim: '\\t', quotes: 'none', batchSize: %d" % EXPORT_BATCH_SIZE
+        if params:
+            config += ", params: {" + ", ".join(
+                "%s: %s" % (key, cypher_literal(value)) for key, value in params.items()
+            ) + "}"
+        statement = ("CALL apoc.export.csv.query(" + cypher_string(query) + ", " + cypher_string(path)
+                     + ", {" + config + "}) YIELD rows RETURN rows")
+        result = nc.commit_list(statements=[statement])
+        if result is False:
+            print(f"Change log export failed: {statement}")
+            return False
+        if result[0]['data']:
+            self.parts.append(path)
+        return True
+
+    def write_step(self, name):
+        """
+        Merge the step's part files into <directory>/<name>.tsv.gz and remove them.
+
+        :return: (number of entries written, paths of part files the server reported but that are missing here).
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        found = [part for part in self.parts if os.path.exists(part)]
+        missing = [part for part in self.parts if part not in found]
+        path = os.path.join(self.directory, name + ".tsv.gz")
+        count = write_merged(path, [read_entries(part) for part in found])
+        for part in found:
+            os.remove(part)
+        self.parts = []
+        self.files.append(path)
+        return count, missing
+
+    def merge(self):
+        """
+        Merge the step files written during this run into the changeset.
+
+        :return: (path, number of entries) of the changeset.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, CHANGESET)
+        return path, write_merged(path, [read_entries(file) for file in self.files])
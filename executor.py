@@ -0,0 +1,449 @@
+import json
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+# Defaults for statements rewritten into apoc.periodic.iterate jobs
+BATCH_SIZE = 10000
+BATCH_RETRIES = 3
+
+# Write-conflict classes for batched jobs:
+# LABEL_ONLY    - only adds/removes labels on the returned nodes
+# OWN_NODE      - only sets properties on (or deletes) the node each row returns
+# RELATIONSHIP  - creates, merges or deletes relationships between returned nodes
+LABEL_ONLY = "label-only"
+OWN_NODE = "own-node"
+RELATIONSHIP = "relationship-creating"
+PARALLEL_SAFE = (LABEL_ONLY, OWN_NODE)
+
+# Clauses that make a statement unsafe to split into independent batches:
+# anything that creates/deletes, already runs its own transactions, or whose
+# result depends on seeing the whole match at once.
+_UNSAFE_CLAUSES = re.compile(
+    r"\b(MERGE|CREATE|DELETE|DETACH|REMOVE|FOREACH|CALL|LOAD\s+CSV|UNWIND|OPTIONAL|RETURN|UNION)\b",
+    re.IGNORECASE,
+)
+_AGGREGATES = re.compile(
+    r"\b(COUNT|COLLECT|SUM|AVG|MIN|MAX|percentileCont|percentileDisc|stDev|stDevP)\s*\(",
+    re.IGNORECASE,
+)
+_SET = re.compile(r"\bSET\b", re.IGNORECASE)
+_WRITE_CLAUSE = re.compile(r"\b(MERGE|CREATE|SET|DELETE|DETACH|REMOVE|FOREACH)\b", re.IGNORECASE)
+_TAIL_UNSAFE = re.compile(r"\b(MATCH|WITH|WHERE)\b", re.IGNORECASE)
+_PATTERN_VARIABLE = re.compile(r"[(\[]\s*([A-Za-z_]\w*)\b(?!\s*[.(])")
+_ALIAS = re.compile(r"\bAS\s+([A-Za-z_]\w*)", re.IGNORECASE)
+_NAMED_PATH = re.compile(r"(?:\bMATCH|,)\s*[A-Za-z_]\w*\s*=\s*\(", re.IGNORECASE)
+_NOT_VARIABLES = {"true", "false", "null", "not", "exists", "distinct"}
+_WITH = re.compile(r"\bWITH(\s+DISTINCT)?\b", re.IGNORECASE)
+_STARTS_ENDS = re.compile(r"\b(STARTS|ENDS)\s+$", re.IGNORECASE)
+_AFTER_PROJECTION = re.compile(r"\b(WHERE|MATCH|OPTIONAL|UNWIND|CALL|ORDER|SKIP|LIMIT|LOAD)\b", re.IGNORECASE)
+_PROJECTED_ALIAS = re.compile(r"\bAS\s+([A-Za-z_]\w*)$", re.IGNORECASE)
+_ITERATION_VARIABLE = re.compile(r"[(\[,]\s*([A-Za-z_]\w*)\s+IN\b", re.IGNORECASE)
+_ACCUMULATOR = re.compile(r"\breduce\s*\(\s*([A-Za-z_]\w*)\s*=", re.IGNORECASE)
+_DETACH_DELETE = re.compile(r"\bDETACH\s+DELETE\s+([A-Za-z_]\w*(?:\s*,\s*[A-Za-z_]\w*)*)", re.IGNORECASE)
+
+
+def _mask_strings(statement):
+    """
+    Blank out the contents of string literals so keyword searches only see Cypher syntax.
+
+    The returned string has the same length as the input, so indices can be used to slice the original.
+    """
+    masked = []
+    quote = None
+    escaped = False
+    for char in statement:
+        if quote:
+            if escaped:
+                escaped = False
+                masked.append('x')
+            elif char == '\\':
+                escaped = True
+                masked.append('x')
+            elif char == quote:
+                quote = None
+                masked.append(char)
+            else:
+                masked.append('x')
+        else:
+            if char in ("'", '"'):
+                quote = char
+            masked.append(char)
+    return ''.join(masked)
+
+
+def cypher_string(value):
+    """Quote a Python string as a double-quoted Cypher string literal."""
+    return '"' + value.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+def split_update(statement):
+    """
+    Split a 'MATCH ... SET ...' statement into its read and update halves.
+
+    Only the shape of the statement is checked: whether the update is safe to apply twice
+    to the same rows is up to the caller (see run_statements).
+
+    :param statement: A single Cypher statement.
+    :return: (read, update, variables) where variables are the identifiers bound by the read half
+             that the update half needs, or None if the statement cannot be split into batches.
+    """
+    statement = statement.strip().rstrip(';').strip()
+    masked = _mask_strings(statement)
+    if not re.match(r"MATCH\b", masked, re.IGNORECASE):
+        return None
+    if _UNSAFE_CLAUSES.search(masked) or _AGGREGATES.search(masked) or _NAMED_PATH.search(masked):
+        return None
+    set_clause = _SET.search(masked)
+    if not set_clause:
+        return None
+    head, tail = masked[:set_clause.start()], masked[set_clause.start():]
+    if _TAIL_UNSAFE.search(tail):
+        return None
+    variables = _used_variables(head, tail)
+    if not variables:
+        return None
+    return statement[:set_clause.start()].strip(), statement[set_clause.start():].strip(), variables
+
+
+def _split_top_level(text, separator=","):
+    """Split (masked) text on a separator that is not nested in brackets, parentheses or braces."""
+    parts = []
+    depth = 0
+    start = 0
+    for i, char in enumerate(text):
+        if char in "([{":
+            depth += 1
+        elif char in ")]}":
+            depth -= 1
+        elif char == separator and depth == 0:
+            parts.append(text[start:i])
+            start = i + 1
+    parts.append(text[start:])
+    return parts
+
+
+def _depths(text):
+    """Bracket nesting depth of each character of (masked) text."""
+    depths = []
+    depth = 0
+    for char in text:
+        if char in ")]}":
+            depth -= 1
+        depths.append(depth)
+        if char in "([{":
+            depth += 1
+    return depths
+
+
+def _bound_variables(head):
+    """
+    Identifiers in scope at the end of a (masked) read half, in order of appearance.
+
+    After a WITH only the names it projects and the names bound by later clauses are in scope.
+    Names bound inside a nested subquery ({...}) or by a list comprehension, FOREACH or reduce
+    are never in scope outside it.
+    """
+    depths = _depths(head)
+    withs = [match for match in _WITH.finditer(head)
+             if depths[match.start()] == 0 and not _STARTS_ENDS.search(head[:match.start()])]
+    names = []
+    if withs:
+        last = withs[-1]
+        segment = head[last.end():]
+        clause = _AFTER_PROJECTION.search(segment)
+        projection = segment[:clause.start()] if clause else segment
+        for item in _split_top_level(projection):
+            item = item.strip()
+            alias = _PROJECTED_ALIAS.search(item)
+            if item == "*":
+                names.extend(_bound_variables(head[:last.start()]))
+            elif re.match(r"[A-Za-z_]\w*$", item):
+                names.append(item)
+            elif alias:
+                names.append(alias.group(1))
+        offset = last.end() + len(projection)
+    else:
+        offset = 0
+    for pattern in (_PATTERN_VARIABLE, _ALIAS):
+        names.extend(match.group(1) for match in pattern.finditer(head, offset) if depths[match.start()] == 0)
+    iterated = set(_ITERATION_VARIABLE.findall(head)) | set(_ACCUMULATOR.findall(head))
+    bound = []
+    for name in names:
+        if name.lower() not in _NOT_VARIABLES and name not in iterated and name not in bound:
+            bound.append(name)
+    return bound
+
+
+def _used_variables(head, tail):
+    """Identifiers in scope at the end of the (masked) head of a statement that its (masked) tail refers to."""
+    iterated = set(_ITERATION_VARIABLE.findall(tail)) | set(_ACCUMULATOR.findall(tail))
+    return [name for name in _bound_variables(head)
+            if name not in iterated and re.search(r"(?<![.\w:`])" + name + r"\b", tail)]
+
+
+def split_writes(statement):
+    """
+    Split a statement at its first write clause, for reading what it is about to change.
+
+    Unlike split_update this accepts any MATCH or LOAD CSV statement, including ones that
+    create, merge or delete, since the read half is only run on its own and never batched.
+
+    :param statement: A single Cypher statement.
+    :return: (read, variables) where variables are the identifiers bound by the read half that
+             the write half uses, or None if the statement does not start with a read clause
+             (e.g. a CALL apoc.periodic.iterate job or a bare MERGE).
+    """
+    statement = statement.strip().rstrip(';').strip()
+    masked = _mask_strings(statement)
+    if not re.match(r"(OPTIONAL\s+MATCH|MATCH|LOAD\s+CSV)\b", masked, re.IGNORECASE):
+        return None
+    write_clause = _WRITE_CLAUSE.search(masked)
+    if not write_clause:
+        return None
+    variables = _used_variables(masked[:write_clause.start()], masked[write_clause.start():])
+    if not variables:
+        return None
+    return statement[:write_clause.start()].strip(), variables
+
+
+def may_write(statement):
+    """True if a statement contains a write clause or calls a procedure, which may write."""
+    masked = _mask_strings(statement)
+    return bool(_WRITE_CLAUSE.search(masked) or re.search(r"\bCALL\b", masked, re.IGNORECASE))
+
+
+def detach_deleted(statement):
+    """Variables a statement (or update) removes with DETACH DELETE, along with all their relationships."""
+    return [name.strip() for match in _DETACH_DELETE.finditer(_mask_strings(statement))
+            for name in match.group(1).split(',')]
+
+
+def cypher_literal(value):
+    """Format a Python value (None, str, number, bool or a list of these) as a Cypher literal."""
+    if value is None:
+        return "null"
+    if isinstance(value, str):
+        return cypher_string(value)
+    if isinstance(value, (list, tuple)):
+        return "[" + ", ".join(cypher_literal(item) for item in value) + "]"
+    return json.dumps(value)
+
+
+def iterate_statement(read, update, batch_size=BATCH_SIZE, retries=BATCH_RETRIES, parallel=False,
+                      concurrency=None, params=None):
+    """
+    Build an apoc.periodic.iterate call that reports its batch counts and errors.
+
+    :param read: Query streaming the rows to update.
+    :param update: Update applied to each batch of rows.
+    :param parallel: Run batches concurrently; only safe when batches cannot write the same entities.
+    :param concurrency: Number of concurrent batches when parallel.
+    :param params: Dict of values available to both queries as $parameters.
+    """
+    config = "batchSize: %d, parallel: %s, retries: %d" % (batch_size, "true" if parallel else "false", retries)
+    if parallel and concurrency:
+        config += ", concurrency: %d" % concurrency
+    if params:
+        config += ", params: {" + ", ".join(
+            "%s: %s" % (name, cypher_literal(value)) for name, value in params.items()
+        ) + "}"
+    return (
+        "CALL apoc.periodic.iterate("
+        + cypher_string(read) + ", "
+        + cypher_string(update) + ", "
+        + "{" + config + "}) "
+        + "YIELD batches, total, failedBatches, errorMessages "
+        + "RETURN batches, total, failedBatches, errorMessages"
+    )
+
+
+def report_batches(result, statement):
+    """
+    Print a summary of an apoc.periodic.iterate job from its commit_list result.
+
+    :return: True if every batch committed, False otherwise.
+    """
+    if not result:
+        print(f"Batched statement failed: {statement}")
+        return False
+    try:
+        batches, total, failed, errors = result[0]['data'][0]['row']
+    except (KeyError, IndexError, TypeError, ValueError):
+        return True
+    print(f"Batched update: {total} rows in {batches} batches, {failed} failed batches")
+    if failed:
+        print(f"Batch errors for statement: {statement}")
+        for message, count in (errors or {}).items():
+            print(f"  {count} x {message}")
+        return False
+    return True
+
+
+def is_deadlock(result):
+    """True if an apoc.periodic.iterate result reports batches lost to deadlocks."""
+    try:
+        errors = result[0]['data'][0]['row'][3] or {}
+    except (KeyError, IndexError, TypeError):
+        return False
+    return any('deadlock' in message.lower() for message in errors)
+
+
+def commit_iterate(nc, read, update, parallel=False, concurrency=None, **kwargs):
+    """
+    Commit one apoc.periodic.iterate job, rerunning it serially if parallel batches deadlocked.
+
+    The rerun streams the whole read query again. It only visits the rows the lost batches
+    left behind if the read matches just the rows that still need updating (e.g. guarded by
+    'AND NOT n:Label'), and it is only correct if the update is safe to apply twice; jobs
+    passed to Pipeline.iterate and statements batched by run_statements must be written that way.
+
+    :return: (ok, deadlocked) where deadlocked is True if the job (serial or not) lost batches to deadlocks.
+    """
+    statement = iterate_statement(read, update, parallel=parallel, concurrency=concurrency, **kwargs)
+    result = nc.commit_list(statements=[statement])
+    ok = report_batches(result, statement)
+    if not ok and parallel and is_deadlock(result):
+        print("Parallel batches deadlocked; rerunning serially...")
+        statement = iterate_statement(read, update, **kwargs)
+        result = nc.commit_list(statements=[statement])
+        ok = report_batches(result, statement)
+    return ok, not ok and is_deadlock(result)
+
+
+def partition_rounds(classes):
+    """
+    Schedule every pair of node classes, including each class with itself, into rounds
+    in which no class appears twice (a round-robin tournament plus a diagonal round).
+
+    :param classes: Even number of node classes.
+    :return: A list of rounds, each a list of (i, j) class pairs.
+    """
+    ring = list(range(classes))
+    rounds = []
+    for _ in range(classes - 1):
+        rounds.append([(ring[i], ring[classes - 1 - i]) for i in range(classes // 2)])
+        ring = [ring[0], ring[-1]] + ring[1:-1]
+    rounds.append([(i, i) for i in range(classes)])
+    return rounds
+
+
+def run_partitioned(nc, match, returns, update, nodes, workers, batch_size=BATCH_SIZE, retries=BATCH_RETRIES):
+    """
+    Run a relationship-creating iterate job on several workers without two workers sharing a node.
+
+    Nodes are split into 2 * workers classes by id. One job runs per pair of classes, and its
+    read only returns the rows whose nodes fall into that pair; the partitioning is done on the
+    server, with the same query text for every pair, so only the class numbers are sent as
+    parameters. Jobs only run together when their classes are disjoint, so concurrent
+    transactions never lock the same node. Each job scans the match again, which suits the
+    relationship-creating jobs here: the scan is cheap next to their MERGE/CREATE/DELETE. Jobs
+    that still deadlock are rerun serially; the rerun only visits the rows they left behind if
+    the match excludes rows already updated (e.g. the deleted relationship of a MERGE ... DELETE).
+
+    :param match: MATCH (and WHERE) part of the read query, without RETURN.
+    :param returns: Comma-separated variables returned to the update.
+    :param nodes: One or two node variables of the match used to partition rows.
+    :param workers: Number of concurrent jobs.
+    :return: True if every job succeeded, False otherwise.
+    """
+    classes = 2 * workers
+    a, b = nodes[0], nodes[-1]
+    if len(nodes) == 1:
+        partition = f"id({a}) % $classes = $i"
+        rounds = [[(i, i) for i in range(classes)]]
+    else:
+        partition = f"[id({a}) % $classes, id({b}) % $classes] IN [[$i, $j], [$j, $i]]"
+        rounds = partition_rounds(classes)
+    read = f"{match} WITH DISTINCT {returns} WHERE {partition} RETURN {returns}"
+
+    def job(pair):
+        return commit_iterate(nc, read, update, batch_size=batch_size, retries=retries,
+                              params={'classes': classes, 'i': pair[0], 'j': pair[1]})
+
+    ok = True
+    deadlocked = []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for round_pairs in rounds:
+            pairs = [tuple(sorted(pair)) for pair in round_pairs]
+            for pair, (job_ok, job_deadlocked) in zip(pairs, pool.map(job, pairs)):
+                if job_deadlocked:
+                    deadlocked.append(pair)
+                else:
+                    ok = ok and job_ok
+    if deadlocked:
+        print("Partitioned batches deadlocked; rerunning their jobs serially...")
+        for pair in deadlocked:
+            ok = job(pair)[0] and ok
+    return ok
+
+
+def run_iterate(nc, match, returns, update, conflicts=None, nodes=None, workers=1,
+                batch_size=BATCH_SIZE, retries=BATCH_RETRIES):
+    """
+    Run an apoc.periodic.iterate job as concurrently as its write-conflict class allows.
+
+    LABEL_ONLY and OWN_NODE jobs run with parallel batches; RELATIONSHIP jobs are partitioned
+    on the given node variables (see run_partitioned); anything else runs serially.
+
+    :param match: MATCH (and WHERE) part of the read query, without RETURN.
+    :param returns: Comma-separated variables returned to the update.
+    :param conflicts: Write-conflict class of the job (LABEL_ONLY, OWN_NODE, RELATIONSHIP or None).
+    :param nodes: Node variables used to partition RELATIONSHIP jobs.
+    :param workers: Number of concurrent batches or jobs.
+    :return: True if every batch succeeded, False otherwise.
+    """
+    read = f"{match} RETURN DISTINCT {returns}"
+    if workers > 1 and conflicts in PARALLEL_SAFE:
+        return commit_iterate(nc, read, update, parallel=True, concurrency=workers,
+                              batch_size=batch_size, retries=retries)[0]
+    if workers > 1 and conflicts == RELATIONSHIP and nodes:
+        return run_partitioned(nc, match, returns, update, nodes, workers, batch_size, retries)
+    return commit_iterate(nc, read, update, batch_size=batch_size, retries=retries)[0]
+
+
+def run_statements(nc, statements, batch=False, batch_size=BATCH_SIZE, retries=BATCH_RETRIES, parallel=False,
+                   concurrency=None, capture=None):
+    """
+    Commit statements in order, optionally running each as a batched iterate job.
+
+    Batching is opt-in: the caller vouches that every statement is a whole-graph
+    'MATCH ... SET ...' update that is safe to apply twice to the same rows, since a failed
+    batch is retried and a deadlocked job rerun. Each batched statement is committed on its
+    own, so it never runs inside a transaction holding uncommitted writes from an earlier one.
+    Statements that are not batched are committed together in one transaction, unless capture
+    is given: then each is committed on its own, so that the capture of the next statement
+    sees its writes.
+
+    :param nc: A Neo4jConnect instance (e.g. vc.nc).
+    :param statements: A list of Cypher statements.
+    :param batch: True to run every statement as an apoc.periodic.iterate job returning the
+                  distinct rows its update needs (e.g. 'SET n.uniqueFacets = apoc.coll.toSet(n.uniqueFacets)'),
+                  False to commit them as-is.
+    :param batch_size: Number of matched rows updated per transaction.
+    :param retries: Number of times a failed batch is retried before it is reported.
+    :param parallel: Run the batches of each batched statement concurrently (see commit_iterate).
+    :param concurrency: Number of concurrent batches when parallel.
+    :param capture: Optional callable taking a statement, called before the statement is committed
+                    so what it changes can be recorded (see Pipeline.capture_changes).
+    :return: True if every statement (and every batch) succeeded, False otherwise.
+    :raises ValueError: If batch is True and a statement is not a 'MATCH ... SET ...' update.
+    """
+    if not batch:
+        if not capture:
+            return not statements or nc.commit_list(statements=statements) is not False
+        ok = True
+        for statement in statements:
+            capture(statement)
+            ok = nc.commit_list(statements=[statement]) is not False and ok
+        return ok
+    jobs = [split_update(statement) for statement in statements]
+    for statement, parts in zip(statements, jobs):
+        if parts is None:
+            raise ValueError(f"Statement cannot be run as a batched update: {statement}")
+    ok = True
+    for statement, (read, update, variables) in zip(statements, jobs):
+        if capture:
+            capture(statement)
+        ok = commit_iterate(nc, read + " RETURN DISTINCT " + ", ".join(variables), update, parallel=parallel,
+                            concurrency=concurrency, batch_size=batch_size, retries=retries)[0] and ok
+    return ok
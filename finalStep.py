@@ -1,129 +1,132 @@
-import time
-import timeit
+import glob
 import os
-from vfb_connect.cross_server_tools import VfbConnect
+from executor import LABEL_ONLY, OWN_NODE, RELATIONSHIP
+from normalization import score_rules
+from pipeline import Pipeline
+from run_synonym_edges import synonym_edge_changes, synonym_edge_statements
 
-# Set up the VfbConnect instance
-vc = VfbConnect(neo_endpoint=str(os.environ.get('PDBserver')), neo_credentials=('neo4j', str(os.environ.get('PDBpass'))))
 
-# Monitoring function for running APOC periodic jobs
-def is_apoc_jobs_running():
-    query = """
-    CALL dbms.listQueries() 
-    YIELD query, status 
-    WHERE status = 'running' AND (query CONTAINS 'apoc.periodic.iterate' OR query CONTAINS 'LOAD CSV')
-    RETURN COUNT(*) AS running
+# Set up the VfbConnect instance; only called once a step first needs the server
+def connect():
+    from vfb_connect.cross_server_tools import VfbConnect
+    return VfbConnect(neo_endpoint=str(os.environ.get('PDBserver')), neo_credentials=('neo4j', str(os.environ.get('PDBpass'))))
+
+
+pipeline = Pipeline("finalStep", connect)
+
+# NBLAST and NeuronBridge scores are stored as numbers; --score-format list (or SCORE_FORMAT=list)
+# keeps the single-element list form ([score]) for consumers that still expect it.
+pipeline.add_option('--score-format', choices=['number', 'list'], default=os.environ.get('SCORE_FORMAT', 'number'),
+                    help="store NBLAST and NeuronBridge scores as numbers or as single-element lists "
+                         "([score]) for consumers that still expect them (default: $SCORE_FORMAT or number)")
+
+
+def score_as_list():
+    """True if scores are stored as single-element lists."""
+    return pipeline.options['score_format'] == 'list'
+
+
+def score_value(expression):
+    """Wrap a numeric score expression in the stored score format."""
+    return f"[{expression}]" if score_as_list() else expression
+
+
+def score_of(relationship, prop="NBLAST_score"):
+    """Expression reading the numeric score stored on a relationship variable."""
+    return f"{relationship}.{prop}[0]" if score_as_list() else f"{relationship}.{prop}"
+
+
+def nblast_load_statement(file_name, relationship="has_similar_morphology_to", label="NBLAST"):
     """
-    try:
-        result = vc.nc.commit_list(statements=[query])
-        # Parsing the result based on the expected response structure
-        if result and 'data' in result[0] and result[0]['data']:
-            # Extract the count from the first row
-            running_count = result[0]['data'][0]['row'][0]
-            return running_count > 1
-        return False
-    except Exception as e:
-        print(f"Error while checking APOC jobs: {e}")
-        # Decide whether to treat this as running or not based on your requirements
-        return True  # Assume jobs are running if there's an error
-
-def monitor_apoc_jobs(check_interval=1800, max_wait_time=864000):
+    LOAD CSV statement adding (or updating) NBLAST score edges from a query/target/score TSV.
+
+    Rows whose edge and labels are already in place are skipped, so reloading a file only
+    writes (and records in the change log) the scores that changed.
     """
-    Monitor APOC periodic jobs and wait until all running jobs have completed.
-    
-    :param check_interval: Time in seconds between checks (default: 1800 seconds = 30 minutes)
-    :param max_wait_time: Maximum time in seconds to wait before aborting (default: 86400 seconds = 24 hours)
+    return f"""
+    LOAD CSV WITH HEADERS FROM 'file:///{file_name}' AS row
+    FIELDTERMINATOR '\\t'
+    MATCH (s:Individual {{short_form: row.query}}), (b:Individual {{short_form: row.target}})
+    WITH s, b, toFloat(row.score) as score
+    OPTIONAL MATCH (s)-[r:{relationship}]-(b)
+    WITH s, b, r, score
+    WHERE r IS NULL OR NOT r.NBLAST_score = {score_value('score')} OR NOT (s:{label} AND b:{label})
+    FOREACH (ignoreMe IN CASE WHEN r IS NULL THEN [1] ELSE [] END |
+        MERGE (s)-[r:{relationship} {{
+            iri: "http://n2o.neo/custom/{relationship}",
+            short_form: "{relationship}",
+            type: "Annotation",
+            NBLAST_score: {score_value('score')}
+        }}]->(b)
+    )
+    WITH s, b, r, score
+    SET r.NBLAST_score = {score_value('score')}
+    SET s:{label}, b:{label}
+    RETURN count(*) as relationships_processed
     """
-    print("Monitoring for running APOC periodic jobs...")
-    start_time = time.time()
-    try:
-        while True:
-            if is_apoc_jobs_running():
-                elapsed = time.time() - start_time
-                if elapsed > max_wait_time:
-                    print("Maximum wait time exceeded. Exiting monitoring.")
-                    break
-                minutes = check_interval // 60
-                print(f"An APOC periodic job is still running. Checking again in {minutes} minutes...")
-                time.sleep(check_interval)
-            else:
-                print("No APOC periodic jobs are running. Exiting monitoring.")
-                break
-    except KeyboardInterrupt:
-        print("Monitoring interrupted by user. Exiting.")
-
-# Fix RO id edge types
-start = timeit.default_timer()
-print("Fix RO id edge types...")
-
-# First, update ObjectProperty labels
-vc.nc.commit_list(statements=[
-    "MATCH (n:ObjectProperty) WHERE n.label STARTS WITH 'RO_' SET n.label = n.label_rdfs[0]"
-])
-
-# Process RO_0002292 (expresses) relationships
-vc.nc.commit_list(statements=[
-    "CALL apoc.periodic.iterate('MATCH (a)<-[r1:RO_0002292]-(b) RETURN a, b, r1', 'MERGE (a)<-[r2:expresses]-(b) SET r2 += r1 SET r2.label=\"expresses\" SET r2.type=\"Related\" DELETE r1', {batchSize: 100, parallel: false})"
-])
-start_monitor = timeit.default_timer()
-monitor_apoc_jobs()
-stop_monitor = timeit.default_timer()
-print('Monitoring Run time: ', stop_monitor - start_monitor, 'seconds')
-
-# Process RO_0002120 (synapsed_to) relationships
-vc.nc.commit_list(statements=[
-    "CALL apoc.periodic.iterate('MATCH (a)<-[r1:RO_0002120]-(b) RETURN a, b, r1', 'MERGE (a)<-[r2:synapsed_to]-(b) SET r2 += r1 SET r2.label=\"synapsed to\" SET r2.type=\"Related\" DELETE r1', {batchSize: 100, parallel: false})"
-])
-start_monitor = timeit.default_timer()
-monitor_apoc_jobs()
-stop_monitor = timeit.default_timer()
-print('Monitoring Run time: ', stop_monitor - start_monitor, 'seconds')
-
-# Process RO_0002175 (present_in_taxon) relationships
-vc.nc.commit_list(statements=[
-    "CALL apoc.periodic.iterate('MATCH (a)<-[r1:RO_0002175]-(b) RETURN a, b, r1', 'MERGE (a)<-[r2:present_in_taxon]-(b) SET r2 += r1 SET r2.label=\"present in taxon\" SET r2.type=\"Related\" DELETE r1', {batchSize: 100, parallel: false})"
-])
-start_monitor = timeit.default_timer()
-monitor_apoc_jobs()
-stop_monitor = timeit.default_timer()
-print('Monitoring Run time: ', stop_monitor - start_monitor, 'seconds')
-
-# Process RO_0002579 (is_indirect_form_of) relationships
-vc.nc.commit_list(statements=[
-    "CALL apoc.periodic.iterate('MATCH (a)<-[r1:RO_0002579]-(b) RETURN a, b, r1', 'MERGE (a)<-[r2:is_indirect_form_of]-(b) SET r2 += r1 SET r2.label=\"is indirect form of\" SET r2.type=\"Related\" DELETE r1', {batchSize: 100, parallel: false})"
-])
-start_monitor = timeit.default_timer()
-monitor_apoc_jobs()
-stop_monitor = timeit.default_timer()
-print('Monitoring Run time: ', stop_monitor - start_monitor, 'seconds')
-
-# Final cleanup statements
-vc.nc.commit_list(statements=[
-    "MATCH (n) WHERE exists(n.nodeLabel) and n.nodeLabel = ['pub'] and NOT n:pub SET n:pub",
-    "MERGE (p:pub {short_form:'Unattributed'}) ON CREATE SET p += {iri: 'http://flybase.org/reports/Unattributed', uniqueFacets: ['pub']} SET p:Entity SET p:Individual",
-    "MATCH (n) WHERE NOT EXISTS(n.description) AND EXISTS(n.definition) WITH n, apoc.convert.fromJsonMap(n.definition[0]) AS def WHERE EXISTS(def.value) SET n.description = [def.value]"
-])
-
-stop = timeit.default_timer()
-print('Run time: ', stop - start)
-
-# Fix for missing Expression Pattern Tags
-start = timeit.default_timer()
-print("Clean BLOCKED images removing anatomical ind and channel...")
-vc.nc.commit_list(statements=[
-    "MATCH (c:Class {short_form:'VFBext_0000010'})<-[:SUBCLASSOF|INSTANCEOF*]-(n) WHERE not n:Expression_pattern SET n:Expression_pattern;"
-])
-stop = timeit.default_timer()
-print('Run time: ', stop - start)
-
-# Clean BLOCKED images removing anatomical ind and channel
-start = timeit.default_timer()
-print("Clean BLOCKED images removing anatomical ind and channel...")
-vc.nc.commit_list(statements=[
-    "MATCH (i:Individual)<-[:depicts]-(c:Individual)-[:INSTANCEOF]->(cc:Class {short_form:'VFBext_0000014'}) WHERE NOT (c)-[:in_register_with]->(:Template) DETACH DELETE c DETACH DELETE i"
-])
-stop = timeit.default_timer()
-print('Run time: ', stop - start)
+
+
+@pipeline.step("Fix RO id edge types", conflicts=RELATIONSHIP, batch=True)
+def fix_ro_edge_types():
+    # First, update ObjectProperty labels
+    pipeline.run_statements([
+        "MATCH (n:ObjectProperty) WHERE n.label STARTS WITH 'RO_' AND NOT coalesce(n.label = n.label_rdfs[0], false) "
+        "SET n.label = n.label_rdfs[0]"
+    ])
+
+    # Process RO_0002292 (expresses) relationships
+    pipeline.iterate("MATCH (a)<-[r1:RO_0002292]-(b)", "a, b, r1",
+                     "MERGE (a)<-[r2:expresses]-(b) SET r2 += r1 SET r2.label='expresses' SET r2.type='Related' DELETE r1",
+                     batch_size=100, nodes=("a", "b"))
+    pipeline.monitor()
+
+    # Process RO_0002120 (synapsed_to) relationships
+    pipeline.iterate("MATCH (a)<-[r1:RO_0002120]-(b)", "a, b, r1",
+                     "MERGE (a)<-[r2:synapsed_to]-(b) SET r2 += r1 SET r2.label='synapsed to' SET r2.type='Related' DELETE r1",
+                     batch_size=100, nodes=("a", "b"))
+    pipeline.monitor()
+
+    # Process RO_0002175 (present_in_taxon) relationships
+    pipeline.iterate("MATCH (a)<-[r1:RO_0002175]-(b)", "a, b, r1",
+                     "MERGE (a)<-[r2:present_in_taxon]-(b) SET r2 += r1 SET r2.label='present in taxon' SET r2.type='Related' DELETE r1",
+                     batch_size=100, nodes=("a", "b"))
+    pipeline.monitor()
+
+    # Process RO_0002579 (is_indirect_form_of) relationships
+    pipeline.iterate("MATCH (a)<-[r1:RO_0002579]-(b)", "a, b, r1",
+                     "MERGE (a)<-[r2:is_indirect_form_of]-(b) SET r2 += r1 SET r2.label='is indirect form of' SET r2.type='Related' DELETE r1",
+                     batch_size=100, nodes=("a", "b"))
+    pipeline.monitor()
+
+
+@pipeline.step("Final cleanup of pub labels and descriptions", conflicts=OWN_NODE, batch=True)
+def final_cleanup():
+    pipeline.run_statements([
+        "MATCH (n) WHERE exists(n.nodeLabel) and n.nodeLabel = ['pub'] and NOT n:pub SET n:pub",
+        "MATCH (n) WHERE NOT EXISTS(n.description) AND EXISTS(n.definition) WITH n, apoc.convert.fromJsonMap(n.definition[0]) AS def WHERE EXISTS(def.value) SET n.description = [def.value]"
+    ])
+    pipeline.record(
+        "OPTIONAL MATCH (p:pub {short_form:'Unattributed'}) WITH p WHERE p IS NULL OR NOT (p:Entity AND p:Individual) "
+        "RETURN 'node' AS kind, 'Unattributed' AS key"
+    )
+    pipeline.commit([
+        "MERGE (p:pub {short_form:'Unattributed'}) ON CREATE SET p += {iri: 'http://flybase.org/reports/Unattributed', uniqueFacets: ['pub']} SET p:Entity SET p:Individual"
+    ], captured=True)
+
+
+@pipeline.step("Fix for missing Expression Pattern Tags", conflicts=LABEL_ONLY, batch=True)
+def tag_expression_patterns():
+    pipeline.run_statements([
+        "MATCH (c:Class {short_form:'VFBext_0000010'})<-[:SUBCLASSOF|INSTANCEOF*]-(n) WHERE not n:Expression_pattern SET n:Expression_pattern;"
+    ])
+
+
+@pipeline.step("Clean BLOCKED images removing anatomical ind and channel")
+def clean_blocked_images():
+    pipeline.commit([
+        "MATCH (i:Individual)<-[:depicts]-(c:Individual)-[:INSTANCEOF]->(cc:Class {short_form:'VFBext_0000014'}) WHERE NOT (c)-[:in_register_with]->(:Template) DETACH DELETE c DETACH DELETE i"
+    ])
+
 
 # Clean orphaned imageless individuals whose channel was already stripped.
 # When every in_register_with edge is block:['Missing Image'] the channel is
@@ -131,96 +134,71 @@ print('Run time: ', stop - start)
 # and it survives as a bare stub (label == short_form, no typing/source/image).
 # NB these are synaptic partners, so this also removes their synapsed_to edges
 # — intended, as an imageless neuron cannot be displayed.
-start = timeit.default_timer()
-print("Clean orphaned imageless individuals (no channel, label == short_form)...")
-vc.nc.commit_list(statements=[
-    "CALL apoc.periodic.iterate("
-    "'MATCH (i:Individual) WHERE i.short_form STARTS WITH \"VFB_\" AND i.label = i.short_form "
-    "AND NOT (i)<-[:depicts]-(:Individual) "
-    "AND NOT i:Template AND NOT i:DataSet AND NOT i:Cluster AND NOT i:pub AND NOT i:Person AND NOT i:Site "
-    "RETURN i', "
-    "'DETACH DELETE i', "
-    "{batchSize: 500, parallel: false})"
-])
-stop = timeit.default_timer()
-print('Run time: ', stop - start)
-
-# Add has_neuron/region_connectivity labels
-start = timeit.default_timer()
-print("Add has_neuron/region_connectivity labels...")
-vc.nc.commit_list(statements=[
-    "CALL apoc.periodic.iterate('MATCH (a:Neuron)-[r:synapsed_to]->(b:Neuron) WHERE EXISTS(r.weight) RETURN a, b', 'SET a:has_neuron_connectivity SET b:has_neuron_connectivity', {batchSize: 100, parallel: false})"
-])
-# Start monitoring after executing commit_list statement
-start_monitor = timeit.default_timer()
-monitor_apoc_jobs()
-stop_monitor = timeit.default_timer()
-print('Monitoring Run time: ', stop_monitor - start_monitor, 'seconds')
-vc.nc.commit_list(statements=[
-    "CALL apoc.periodic.iterate('MATCH (n:Neuron)-[r:has_presynaptic_terminals_in]->(c:Synaptic_neuropil) RETURN n', 'SET n:has_region_connectivity', {batchSize: 100, parallel: false})"
-])
-# Start monitoring after executing commit_list statement
-start_monitor = timeit.default_timer()
-monitor_apoc_jobs()
-stop_monitor = timeit.default_timer()
-print('Monitoring Run time: ', stop_monitor - start_monitor, 'seconds')
-vc.nc.commit_list(statements=[
-    "CALL apoc.periodic.iterate('MATCH (n:Neuron)-[r:has_postsynaptic_terminal_in]->(c:Synaptic_neuropil) RETURN n', 'SET n:has_region_connectivity', {batchSize: 100, parallel: false})"
-])
-# Start monitoring after executing commit_list statement
-start_monitor = timeit.default_timer()
-monitor_apoc_jobs()
-stop_monitor = timeit.default_timer()
-print('Monitoring Run time: ', stop_monitor - start_monitor, 'seconds')
-stop = timeit.default_timer()
-print('Run time: ', stop - start)
-
-
-
-# Clean NBLAST
-start = timeit.default_timer()
-print("Clean NBLAST...")
-vc.nc.commit_list(statements=[
-    "MATCH (a:NBLAST) REMOVE a:NBLAST",
-    "MATCH (a:Individual)-[r1:has_similar_morphology_to]->(a) WHERE r1.NBLAST_score[0] = 1 DELETE r1",
-    "MATCH (a:Individual)-[r1:has_similar_morphology_to]->(b:Individual) MATCH (b)-[r2:has_similar_morphology_to]->(a) WHERE NOT r1.NBLAST_score[0] = r2.NBLAST_score[0] MATCH (b)-[r:has_similar_morphology_to]-(a) WITH r1, r2, AVG(r.NBLAST_score[0]) AS mean SET r1.NBLAST_score=[mean] DELETE r2",
-    "MATCH (a:Individual)-[r1:has_similar_morphology_to]->(b:Individual) MATCH (b)-[r2:has_similar_morphology_to]->(a) WHERE r1.NBLAST_score[0] = r2.NBLAST_score[0] DELETE r2",
-    "MATCH (a:Individual)-[nblast:has_similar_morphology_to]-(b:Individual) SET a:NBLAST SET b:NBLAST"
-])
-stop = timeit.default_timer()
-print('Run time: ', stop - start)
-
-# Add any missing Project Labels
-start = timeit.default_timer()
-print("Add any missing Project Labels...")
-vc.nc.commit_list(statements=[
-    "MATCH (i:Individual)-[:database_cross_reference]->(s:Site {short_form:'catmaid_fafb'}) SET i:FAFB",
-    "MATCH (i:Individual)-[:database_cross_reference]->(s:Site {short_form:'catmaid_l1em'}) SET i:L1EM",
-    "MATCH (i:Individual)-[:database_cross_reference]->(s:Site {short_form:'catmaid_fanc'}) SET i:FANC",
-    "MATCH (i:Individual)-[:database_cross_reference]->(s:Site {short_form:'neuprint_JRC_Hemibrain_1point1'}) SET i:FlyEM_HB",
-    "MATCH (i:Individual)-[:database_cross_reference]->(s:Site {short_form:'FlyCircuit'}) SET i:FlyCircuit"
-])
-stop = timeit.default_timer()
-print('Run time: ', stop - start)
+# Each row deletes only its own node; batches can still meet on a shared neighbour,
+# which the deadlock fallback in executor.commit_iterate takes care of.
+@pipeline.step("Clean orphaned imageless individuals (no channel, label == short_form)", conflicts=OWN_NODE)
+def clean_orphaned_individuals():
+    pipeline.iterate(
+        "MATCH (i:Individual) WHERE i.short_form STARTS WITH 'VFB_' AND i.label = i.short_form "
+        "AND NOT (i)<-[:depicts]-(:Individual) "
+        "AND NOT i:Template AND NOT i:DataSet AND NOT i:Cluster AND NOT i:pub AND NOT i:Person AND NOT i:Site",
+        "i",
+        "DETACH DELETE i",
+        batch_size=500)
+
+
+# One row per neuron still missing its label, so parallel batches never share a node
+# and a rerun only visits the neurons left behind.
+@pipeline.step("Add has_neuron/region_connectivity labels", conflicts=LABEL_ONLY)
+def add_connectivity_labels():
+    pipeline.iterate("MATCH (n:Neuron) WHERE NOT n:has_neuron_connectivity "
+                     "AND EXISTS { MATCH (n)-[r:synapsed_to]-(:Neuron) WHERE EXISTS(r.weight) }", "n",
+                     "SET n:has_neuron_connectivity")
+    pipeline.monitor()
+    pipeline.iterate("MATCH (n:Neuron) WHERE NOT n:has_region_connectivity "
+                     "AND ((n)-[:has_presynaptic_terminals_in]->(:Synaptic_neuropil) "
+                     "OR (n)-[:has_postsynaptic_terminal_in]->(:Synaptic_neuropil))", "n",
+                     "SET n:has_region_connectivity")
+    pipeline.monitor()
+
+
+# One-time migration of scores left as strings by earlier loads; the loaders now write numbers,
+# so it only runs when named with --only convert_scores. Already converted edges are skipped.
+@pipeline.step("Convert NBLAST and NeuronBridge scores to numbers", optional=True)
+def convert_scores():
+    pipeline.normalize(score_rules(as_list=score_as_list()))
+
+
+# NBLAST labels are reconciled after the duplicate edges are removed rather than stripped
+# and re-added, so only nodes whose label actually changes are written.
+@pipeline.step("Clean NBLAST")
+def clean_nblast():
+    pipeline.run_statements([
+        f"MATCH (a:Individual)-[r1:has_similar_morphology_to]->(a) WHERE {score_of('r1')} = 1 DELETE r1",
+        f"MATCH (a:Individual)-[r1:has_similar_morphology_to]->(b:Individual) MATCH (b)-[r2:has_similar_morphology_to]->(a) WHERE NOT {score_of('r1')} = {score_of('r2')} MATCH (b)-[r:has_similar_morphology_to]-(a) WITH r1, r2, AVG({score_of('r')}) AS mean SET r1.NBLAST_score={score_value('mean')} DELETE r2",
+        f"MATCH (a:Individual)-[r1:has_similar_morphology_to]->(b:Individual) MATCH (b)-[r2:has_similar_morphology_to]->(a) WHERE {score_of('r1')} = {score_of('r2')} DELETE r2",
+        "MATCH (a:NBLAST) WHERE NOT (a:Individual AND (a)-[:has_similar_morphology_to]-(:Individual)) REMOVE a:NBLAST"
+    ])
+    pipeline.run_statements([
+        "MATCH (a:Individual)-[:has_similar_morphology_to]-(:Individual) WHERE NOT a:NBLAST SET a:NBLAST"
+    ], batch=True)
+
+
+@pipeline.step("Add any missing Project Labels", conflicts=LABEL_ONLY, batch=True)
+def add_project_labels():
+    pipeline.run_statements([
+        "MATCH (i:Individual)-[:database_cross_reference]->(s:Site {short_form:'catmaid_fafb'}) WHERE NOT i:FAFB SET i:FAFB",
+        "MATCH (i:Individual)-[:database_cross_reference]->(s:Site {short_form:'catmaid_l1em'}) WHERE NOT i:L1EM SET i:L1EM",
+        "MATCH (i:Individual)-[:database_cross_reference]->(s:Site {short_form:'catmaid_fanc'}) WHERE NOT i:FANC SET i:FANC",
+        "MATCH (i:Individual)-[:database_cross_reference]->(s:Site {short_form:'neuprint_JRC_Hemibrain_1point1'}) WHERE NOT i:FlyEM_HB SET i:FlyEM_HB",
+        "MATCH (i:Individual)-[:database_cross_reference]->(s:Site {short_form:'FlyCircuit'}) WHERE NOT i:FlyCircuit SET i:FlyCircuit"
+    ])
 
-# Create missing pub nodes for synonym references (e.g. DOI-based refs not imported via FlyBase).
-# Without this, MATCH (p:pub ...) in the synonym expansion silently drops any synonym whose
-# database_cross_reference points to a pub node that doesn't yet exist in the graph.
-#
-# DOI pub nodes use short_form with ':' '.' '/' all replaced by '_', e.g.:
-#   "doi:10.1101/2025.10.09.680999"  →  short_form: "doi_10_1101_2025_10_09_680999"
-#   iri: "https://doi.org/10.1101/2025.10.09.680999"
-#   DOI: ["10.1101/2025.10.09.680999"]
-# FlyBase pub nodes use the ID after ':' as short_form, e.g.:
-#   "FlyBase:FBrf0260535"  →  short_form: "FBrf0260535"
-start = timeit.default_timer()
-print("Creating missing pub nodes for synonym references...")
-synonym_types_for_pubs = ["has_exact_synonym", "has_broad_synonym", "has_narrow_synonym", "has_related_synonym"]
-create_pub_statements = []
-for syn_type in synonym_types_for_pubs:
-    create_pub_statements.append(
-        "CALL apoc.periodic.iterate("
-        "\"MATCH (primary) WHERE EXISTS(primary." + syn_type + ") "
+
+def synonym_pub_read(syn_type):
+    """Read half of the pub creation job for one synonym type, binding prefix, raw_id and short_form_val."""
+    return (
+        "MATCH (primary) WHERE EXISTS(primary." + syn_type + ") "
         "UNWIND primary." + syn_type + " AS syn_str "
         "WITH apoc.convert.fromJsonMap(syn_str) AS syn "
         "WHERE EXISTS(syn.annotations.database_cross_reference) "
@@ -232,454 +210,268 @@ for syn_type in synonym_types_for_pubs:
         "WITH ref, prefix, raw_id, "
         "CASE WHEN prefix = 'doi' "
         "THEN 'doi_' + REPLACE(REPLACE(TRIM(raw_id), '.', '_'), '/', '_') "
-        "ELSE raw_id END AS short_form_val "
-        "RETURN prefix, raw_id, short_form_val\", "
-        "\"MERGE (p:pub {short_form: short_form_val}) "
-        "ON CREATE SET "
-        "p.iri = CASE "
-        "WHEN prefix = 'doi' THEN 'https://doi.org/' + raw_id "
-        "WHEN prefix = 'FlyBase' THEN 'http://flybase.org/reports/' + raw_id "
-        "ELSE 'http://' + prefix + '/' + raw_id END, "
-        "p.curie = CASE WHEN prefix = 'doi' "
-        "THEN 'doi:' + REPLACE(REPLACE(raw_id, '.', '_'), '/', '_') "
-        "ELSE prefix + ':' + raw_id END, "
-        "p.DOI = CASE WHEN prefix = 'doi' THEN [raw_id] ELSE [] END, "
-        "p.label = short_form_val, "
-        "p.uniqueFacets = ['pub'] "
-        "SET p:Entity:Individual\", "
-        "{batchSize: 500, iterateList: true})"
+        "ELSE raw_id END AS short_form_val"
     )
-vc.nc.commit_list(statements=create_pub_statements)
-stop = timeit.default_timer()
-print('Run time: ', stop - start)
-start_monitor = timeit.default_timer()
-monitor_apoc_jobs()
-stop_monitor = timeit.default_timer()
-print('Monitoring Run time: ', stop_monitor - start_monitor, 'seconds')
+
+
+# Create missing pub nodes for synonym references (e.g. DOI-based refs not imported via FlyBase).
+# Without this, MATCH (p:pub ...) in the synonym expansion silently drops any synonym whose
+# database_cross_reference points to a pub node that doesn't yet exist in the graph.
+#
+# DOI pub nodes use short_form with ':' '.' '/' all replaced by '_', e.g.:
+#   "doi:10.1101/2025.10.09.680999"  →  short_form: "doi_10_1101_2025_10_09_680999"
+#   iri: "https://doi.org/10.1101/2025.10.09.680999"
+#   DOI: ["10.1101/2025.10.09.680999"]
+# FlyBase pub nodes use the ID after ':' as short_form, e.g.:
+#   "FlyBase:FBrf0260535"  →  short_form: "FBrf0260535"
+@pipeline.step("Creating missing pub nodes for synonym references")
+def create_synonym_pubs():
+    synonym_types_for_pubs = ["has_exact_synonym", "has_broad_synonym", "has_narrow_synonym", "has_related_synonym"]
+    for syn_type in synonym_types_for_pubs:
+        # Pubs about to be created or labelled, recorded before the job creates them
+        pipeline.record(
+            synonym_pub_read(syn_type) + " WITH DISTINCT short_form_val "
+            "OPTIONAL MATCH (p:pub {short_form: short_form_val}) "
+            "WITH short_form_val, p WHERE p IS NULL OR NOT (p:Entity AND p:Individual) "
+            "RETURN DISTINCT 'node' AS kind, short_form_val AS key ORDER BY kind, key"
+        )
+        pipeline.commit([
+            "CALL apoc.periodic.iterate("
+            "\"" + synonym_pub_read(syn_type) + " RETURN prefix, raw_id, short_form_val\", "
+            "\"MERGE (p:pub {short_form: short_form_val}) "
+            "ON CREATE SET "
+            "p.iri = CASE "
+            "WHEN prefix = 'doi' THEN 'https://doi.org/' + raw_id "
+            "WHEN prefix = 'FlyBase' THEN 'http://flybase.org/reports/' + raw_id "
+            "ELSE 'http://' + prefix + '/' + raw_id END, "
+            "p.curie = CASE WHEN prefix = 'doi' "
+            "THEN 'doi:' + REPLACE(REPLACE(raw_id, '.', '_'), '/', '_') "
+            "ELSE prefix + ':' + raw_id END, "
+            "p.DOI = CASE WHEN prefix = 'doi' THEN [raw_id] ELSE [] END, "
+            "p.label = short_form_val, "
+            "p.uniqueFacets = ['pub'] "
+            "SET p:Entity:Individual\", "
+            "{batchSize: 500, iterateList: true})"
+        ], captured=True)
+    pipeline.monitor()
+
 
 # Expand any missing synonyms
 # short_form lookup mirrors the schema above:
 #   doi refs  → 'doi_' + replace('.','_') + replace('/','_') on the ID part
 #   other refs → SPLIT(ref, ':')[1]  (e.g. FBrf0260535 for FlyBase)
-start = timeit.default_timer()
-print("Expand any missing synonyms...")
-synonym_queries = [
-    {"synonym_type": "has_exact_synonym", "scope": "has_exact_synonym"},
-    {"synonym_type": "has_broad_synonym", "scope": "has_broad_synonym"},
-    {"synonym_type": "has_narrow_synonym", "scope": "has_narrow_synonym"},
-    {"synonym_type": "has_related_synonym", "scope": "has_related_synonym"}
-]
-
-statements = []
-for query in synonym_queries:
-    statements.append(
-        "CALL apoc.periodic.iterate("
-        "\"MATCH (primary) WHERE EXISTS(primary." + query['synonym_type'] + ") RETURN primary\", "
-        "\"WITH primary, "
-        "REDUCE(syns = [], syn IN primary." + query['synonym_type'] + " | syns + [apoc.convert.fromJsonMap(syn)]) AS syns "
-        "UNWIND syns AS syn "
-        "WITH primary, syn, TRIM(COALESCE(syn.annotations.database_cross_reference[0], '')) AS ref "
-        "WITH primary, syn, ref, "
-        "CASE WHEN ref <> '' AND ref CONTAINS ':' THEN SPLIT(ref, ':')[0] ELSE NULL END AS prefix, "
-        "CASE WHEN ref <> '' AND ref CONTAINS ':' THEN TRIM(SPLIT(ref, ':')[1]) ELSE NULL END AS raw_id "
-        "WITH primary, syn, ref, prefix, raw_id, "
-        "CASE WHEN prefix = 'doi' AND raw_id IS NOT NULL "
-        "THEN 'doi_' + REPLACE(REPLACE(raw_id, '.', '_'), '/', '_') "
-        "WHEN raw_id IS NOT NULL THEN raw_id "
-        "ELSE 'Unattributed' END AS pub_short_form, "
-        "CASE WHEN ref = '' OR NOT ref CONTAINS ':' THEN [syn.value] ELSE [ref] END AS unresolved_ref, "
-        "CASE WHEN ref = '' OR NOT ref CONTAINS ':' THEN true ELSE false END AS missing_ref "
-        "OPTIONAL MATCH (p:pub {short_form: pub_short_form}) "
-        "WITH primary, syn, ref, p, p IS NULL AS unresolved, unresolved_ref, missing_ref "
-        "MATCH (fallback:pub {short_form: 'Unattributed'}) "
-        "WITH primary, syn, ref, COALESCE(p, fallback) AS resolved_pub, (unresolved OR missing_ref) AS unresolved, unresolved_ref "
-        "MERGE (primary)-[r:has_reference {typ: 'syn', value: [syn.value]}]->(resolved_pub) "
-        "ON CREATE SET r += { "
-        "iri: 'http://purl.org/dc/terms/references', "
-        "scope: '" + query['scope'] + "', "
-        "short_form: 'references', "
-        "typ: 'syn', "
-        "label: 'has_reference', "
-        "type: 'Annotation'} "
-        "SET r.has_synonym_type = syn.annotations.has_synonym_type "
-        "WITH r, unresolved, unresolved_ref "
-        "FOREACH (x IN CASE WHEN unresolved THEN [1] ELSE [] END | SET r.unresolved_ref = unresolved_ref)\", "
-        "{batchSize: 500, iterateList: true})"
-    )
+@pipeline.step("Expand any missing synonyms")
+def expand_synonyms():
+    for changes, statement in zip(synonym_edge_changes(), synonym_edge_statements()):
+        pipeline.capture(changes, ["primary"])
+        pipeline.commit([statement], captured=True)
+    pipeline.monitor()
+
+
+@pipeline.step("Ensure all deprecated are labelled as such", conflicts=LABEL_ONLY, batch=True)
+def label_deprecated():
+    pipeline.run_statements([
+        "MATCH (n:Individual) WHERE EXISTS(n.deprecated) AND n.deprecated = [true] AND NOT n:Deprecated SET n:Deprecated"
+    ])
+
+
+@pipeline.step("Ensure all xrefs are on separate edges", conflicts=RELATIONSHIP)
+def split_xrefs():
+    pipeline.iterate("MATCH (n)-[r:database_cross_reference]->(s:Site) WHERE SIZE(r.accession) > 1", "n, s, r",
+                     "SET r.accession = [r.accession[0]] CREATE (n)-[r1:database_cross_reference]->(s) SET r1 = r SET r1.accession = TAIL(r.accession)",
+                     batch_size=100, nodes=("n", "s"))
 
-# Commit the statements
-vc.nc.commit_list(statements)
-stop = timeit.default_timer()
-print('Run time: ' + str(stop - start))
-
-# Start monitoring after executing all commit_list statements
-start_monitor = timeit.default_timer()
-monitor_apoc_jobs()
-stop_monitor = timeit.default_timer()
-print('Monitoring Run time: ', stop_monitor - start_monitor, 'seconds')
-
-# Ensure all deprecated are labelled as such
-start = timeit.default_timer()
-print("Ensure all deprecated are labelled as such...")
-vc.nc.commit_list(statements=[
-    "MATCH (n:Individual) WHERE EXISTS(n.deprecated) AND n.deprecated = [true] AND NOT n:Deprecated SET n:Deprecated"
-])
-stop = timeit.default_timer()
-print('Run time: ', stop - start)
-
-# Ensure all xrefs are on separate edges
-start = timeit.default_timer()
-print("Ensure all xrefs are on separate edges...")
-vc.nc.commit_list(statements=[
-    "CALL apoc.periodic.iterate('MATCH (n)-[r:database_cross_reference]->(s:Site) WHERE SIZE(r.accession) > 1 RETURN n, s, r', 'SET r.accession = [r.accession[0]] CREATE (n)-[r1:database_cross_reference]->(s) SET r1 = r SET r1.accession = TAIL(r.accession)', {batchSize: 100, parallel: false})"
-])
-stop = timeit.default_timer()
-print('Run time: ', stop - start)
 
 # ----- START OLD CODE TOBE REMOVED -----
+@pipeline.step("Loading legacy SWC <-> SWC NBLAST scores")
+def load_legacy_nblast():
+    pipeline.monitor()
+    pipeline.commit([nblast_load_statement('OL_FW_FC_ALL_ALL_SWC.tsv')])
+    pipeline.monitor()
+    pipeline.commit([nblast_load_statement('HB_to_HB_OL_FW_FC_SWC.tsv')])
+    pipeline.monitor()
+# --- END OLD CODE TOBE REMOVED ---
 
-# Start monitoring after executing commit_list statement
-start_monitor = timeit.default_timer()
-monitor_apoc_jobs()
-stop_monitor = timeit.default_timer()
-print('Monitoring Run time: ', stop_monitor - start_monitor, 'seconds')
 
-vc.nc.commit_list([
-    """
-    LOAD CSV WITH HEADERS FROM 'file:///OL_FW_FC_ALL_ALL_SWC.tsv' AS row 
-    FIELDTERMINATOR '\\t' 
-    MATCH (s:Individual {short_form: row.query}), (b:Individual {short_form: row.target}) 
-    WITH s, b, row.score as score
-    OPTIONAL MATCH (s)-[r:has_similar_morphology_to]-(b)
-    WITH s, b, r, score
-    FOREACH (ignoreMe IN CASE WHEN r IS NULL THEN [1] ELSE [] END |
-        MERGE (s)-[r:has_similar_morphology_to {
-            iri: "http://n2o.neo/custom/has_similar_morphology_to",
-            short_form: "has_similar_morphology_to",
-            type: "Annotation",
-            NBLAST_score: [score]
-        }]->(b)
-    )
-    WITH s, b, r, score
-    SET r.NBLAST_score = [score]
-    SET s:NBLAST, b:NBLAST
-    RETURN count(*) as relationships_processed
-    """
-])
+@pipeline.step("Processing additional SWC <-> SWC NBLAST score files")
+def load_swc_nblast():
+    # Find all files matching swc_swc_*.tsv pattern
+    swc_files = glob.glob('swc_swc_*.tsv')
+    print(f"Found {len(swc_files)} additional SWC files to process: {swc_files}")
 
-# Start monitoring after executing commit_list statement
-start_monitor = timeit.default_timer()
-monitor_apoc_jobs()
-stop_monitor = timeit.default_timer()
-print('Monitoring Run time: ', stop_monitor - start_monitor, 'seconds')
+    for swc_file in swc_files:
+        print(f"Processing {swc_file}...")
+        # Execute LOAD CSV statement for each file
+        pipeline.commit([nblast_load_statement(swc_file)])
+        # Monitor APOC jobs for this file
+        pipeline.monitor()
 
-vc.nc.commit_list([
-    """
-    LOAD CSV WITH HEADERS FROM 'file:///HB_to_HB_OL_FW_FC_SWC.tsv' AS row 
-    FIELDTERMINATOR '\\t' 
-    MATCH (s:Individual {short_form: row.query}), (b:Individual {short_form: row.target}) 
-    WITH s, b, row.score as score
-    OPTIONAL MATCH (s)-[r:has_similar_morphology_to]-(b)
-    WITH s, b, r, score
-    FOREACH (ignoreMe IN CASE WHEN r IS NULL THEN [1] ELSE [] END |
-        MERGE (s)-[r:has_similar_morphology_to {
-            iri: "http://n2o.neo/custom/has_similar_morphology_to",
-            short_form: "has_similar_morphology_to",
-            type: "Annotation",
-            NBLAST_score: [score]
-        }]->(b)
-    )
-    WITH s, b, r, score
-    SET r.NBLAST_score = [score]
-    SET s:NBLAST, b:NBLAST
-    RETURN count(*) as relationships_processed
-    """
-])
 
-# --- END OLD CODE TOBE REMOVED ---
+@pipeline.step("Loading SPLITS <-> SWC NBLAST scores from CSV")
+def load_splits_nblast():
+    pipeline.commit([
+        nblast_load_statement('splits_swc.tsv', relationship="has_similar_morphology_to_part_of", label="NBLASTexp")
+    ])
+    pipeline.monitor()
 
-# Start monitoring after executing all commit_list statements
-start_monitor = timeit.default_timer()
-monitor_apoc_jobs()
-stop_monitor = timeit.default_timer()
-print('Monitoring Run time: ', stop_monitor - start_monitor, 'seconds')
 
-# Process additional SWC <-> SWC NBLAST score files
-import glob
-start = timeit.default_timer()
-print("Processing additional SWC <-> SWC NBLAST score files...")
-
-# Find all files matching swc_swc_*.tsv pattern
-swc_files = glob.glob('swc_swc_*.tsv')
-print(f"Found {len(swc_files)} additional SWC files to process: {swc_files}")
-
-for swc_file in swc_files:
-    file_start = timeit.default_timer()
-    print(f"Processing {swc_file}...")
-    
-    # Execute LOAD CSV statement for each file
-    vc.nc.commit_list([
+@pipeline.step("Add Neuronbridge Hemibrain <-> slide code top 20 scores")
+def load_neuronbridge():
+    pipeline.commit([
         f"""
-        LOAD CSV WITH HEADERS FROM 'file:///{swc_file}' AS row 
-        FIELDTERMINATOR '\\t' 
-        MATCH (s:Individual {{short_form: row.query}}), (b:Individual {{short_form: row.target}}) 
-        WITH s, b, row.score as score
-        OPTIONAL MATCH (s)-[r:has_similar_morphology_to]-(b)
+        LOAD CSV WITH HEADERS FROM 'file:///top20_scores_agg_short_forms.tsv' AS row
+        FIELDTERMINATOR '\\t'
+        MATCH (s:Individual {{short_form: row.`n.short_form_x`}}), (b:Individual {{short_form: row.`n.short_form_y`}})
+        WITH s, b, toFloat(row.score) as score
+        OPTIONAL MATCH (s)-[r:has_similar_morphology_to_part_of]-(b)
         WITH s, b, r, score
+        WHERE r IS NULL OR NOT r.neuronbridge_score = {score_value('score')} OR NOT (s:neuronbridge AND b:neuronbridge)
         FOREACH (ignoreMe IN CASE WHEN r IS NULL THEN [1] ELSE [] END |
-            MERGE (s)-[r:has_similar_morphology_to {{
-                iri: "http://n2o.neo/custom/has_similar_morphology_to",
-                short_form: "has_similar_morphology_to",
+            MERGE (s)-[r:has_similar_morphology_to_part_of {{
+                iri: "http://n2o.neo/custom/has_similar_morphology_to_part_of",
+                short_form: "has_similar_morphology_to_part_of",
                 type: "Annotation",
-                NBLAST_score: [score]
+                neuronbridge_score: {score_value('score')}
             }}]->(b)
         )
         WITH s, b, r, score
-        SET r.NBLAST_score = [score]
-        SET s:NBLAST, b:NBLAST
-        RETURN count(*) as relationships_processed
+        SET r.neuronbridge_score = {score_value('score')}
+        SET s:neuronbridge, b:neuronbridge
+        RETURN count(*) as relationships_processed;
         """
     ])
-    
-    # Monitor APOC jobs for this file
-    start_monitor = timeit.default_timer()
-    monitor_apoc_jobs()
-    stop_monitor = timeit.default_timer()
-    print(f'Monitoring Run time for {swc_file}: ', stop_monitor - start_monitor, 'seconds')
-    
-    file_stop = timeit.default_timer()
-    print(f'Processing time for {swc_file}: ', file_stop - file_start, 'seconds')
-
-stop = timeit.default_timer()
-print(f'Total time for additional SWC files: ', stop - start, 'seconds')
-
-# Loading SPLITS <-> SWC NBLAST scores from CSV
-start = timeit.default_timer()
-print("Loading SPLITS <-> SWC NBLAST scores from CSV...")
-vc.nc.commit_list([
-    """ 
-    LOAD CSV WITH HEADERS FROM 'file:///splits_swc.tsv' AS row 
-    FIELDTERMINATOR '\\t' 
-    MATCH (s:Individual {short_form: row.query}), (b:Individual {short_form: row.target}) 
-    WITH s, b, row.score as score
-    OPTIONAL MATCH (s)-[r:has_similar_morphology_to_part_of]-(b)
-    WITH s, b, r, score
-    FOREACH (ignoreMe IN CASE WHEN r IS NULL THEN [1] ELSE [] END |
-        MERGE (s)-[r:has_similar_morphology_to_part_of {
-            iri: "http://n2o.neo/custom/has_similar_morphology_to_part_of",
-            short_form: "has_similar_morphology_to_part_of",
-            type: "Annotation",
-            NBLAST_score: [score]
-        }]->(b)
-    )
-    WITH s, b, r, score
-    SET r.NBLAST_score = [score]
-    SET s:NBLASTexp, b:NBLASTexp
-    RETURN count(*) as relationships_processed
-    """
-])
+    pipeline.monitor()
+
+
+@pipeline.step("Add any missing unique facets", conflicts=OWN_NODE, batch=True)
+def add_unique_facets():
+    pipeline.run_statements([
+        "MATCH (n:Deprecated) WHERE NOT EXISTS(n.uniqueFacets) AND NOT n.short_form STARTS WITH 'VFBc_' SET n.uniqueFacets=['Deprecated']",
+        "MATCH (n:Deprecated) WHERE EXISTS(n.uniqueFacets) AND NOT n.short_form STARTS WITH 'VFBc_' AND NOT 'Deprecated' IN n.uniqueFacets SET n.uniqueFacets=n.uniqueFacets + ['Deprecated']",
+        "MATCH (n:DataSet) WHERE NOT EXISTS(n.uniqueFacets) AND NOT n.short_form STARTS WITH 'VFBc_' SET n.uniqueFacets=['DataSet']",
+        "MATCH (n:pub) WHERE NOT EXISTS(n.uniqueFacets) AND NOT n.short_form STARTS WITH 'VFBc_' SET n.uniqueFacets=['pub']",
+        "MATCH (n:Person) WHERE NOT EXISTS(n.uniqueFacets) AND NOT n.short_form STARTS WITH 'VFBc_' SET n.uniqueFacets=['Person']",
+        "MATCH (n:Site) WHERE NOT EXISTS(n.uniqueFacets) AND NOT n.short_form STARTS WITH 'VFBc_' SET n.uniqueFacets=['Site']",
+        "MATCH (n:API) WHERE NOT EXISTS(n.uniqueFacets) AND NOT n.short_form STARTS WITH 'VFBc_' SET n.uniqueFacets=['API']",
+        "MATCH (n:License) WHERE NOT EXISTS(n.uniqueFacets) AND NOT n.short_form STARTS WITH 'VFBc_' SET n.uniqueFacets=['License']",
+        "MATCH (n:Expression_pattern:Split) WHERE NOT EXISTS(n.uniqueFacets) AND NOT n.short_form STARTS WITH 'VFBc_' SET n.uniqueFacets=['Expression_pattern','Split']",
+        "MATCH (n:Expression_pattern) WHERE NOT EXISTS(n.uniqueFacets) AND NOT n.short_form STARTS WITH 'VFBc_' SET n.uniqueFacets=['Expression_pattern']",
+        "MATCH (n:Class) WHERE NOT EXISTS(n.uniqueFacets) AND n.short_form STARTS WITH 'FBtp' SET n.uniqueFacets=['Transgenic_Construct']",
+        "MATCH (n:Class) WHERE NOT EXISTS(n.uniqueFacets) AND n.short_form STARTS WITH 'FBti' SET n.uniqueFacets=['Insertion']",
+        "MATCH (n:Class) WHERE NOT EXISTS(n.uniqueFacets) AND n.short_form STARTS WITH 'FBal' SET n.uniqueFacets=['Allele']",
+        "MATCH (n:Class) WHERE NOT EXISTS(n.uniqueFacets) AND n.short_form STARTS WITH 'FBgn' SET n.uniqueFacets=['Gene']",
+        "MATCH (n:Class) WHERE NOT EXISTS(n.uniqueFacets) AND n.short_form STARTS WITH 'FBrf' SET n.uniqueFacets=['FB_Reference']",
+        "MATCH (n:Class) WHERE NOT EXISTS(n.uniqueFacets) AND n.short_form STARTS WITH 'FBim' SET n.uniqueFacets=['FB_Image']",
+        "MATCH (n:Class) WHERE NOT EXISTS(n.uniqueFacets) AND n.short_form STARTS WITH 'FBdv' SET n.uniqueFacets=['Stage']",
+        "MATCH (n:Class) WHERE n.short_form STARTS WITH 'FBdv' AND NOT n:Stage SET n:Stage",
+        "MATCH (n:Class) WHERE n.short_form STARTS WITH 'FBgn' AND NOT n:Gene SET n:Gene",
+        "MATCH (n:Class) WHERE NOT EXISTS(n.uniqueFacets) SET n.uniqueFacets=['Class']",
+        "MATCH (n:Split) WHERE EXISTS(n.uniqueFacets) AND NOT n.short_form STARTS WITH 'VFBc_' AND NOT 'Split' IN n.uniqueFacets SET n.uniqueFacets=n.uniqueFacets + ['Split']"
+    ])
 
-# Start monitoring after executing commit_list statement
-start_monitor = timeit.default_timer()
-monitor_apoc_jobs()
-stop_monitor = timeit.default_timer()
-print('Monitoring Run time: ', stop_monitor - start_monitor, 'seconds')
-stop = timeit.default_timer()
-print('Run time: ', stop - start)
 
-# Add Neuronbridge Hemibrain <-> slide code top 20 scores using USING PERIODIC COMMIT
-start = timeit.default_timer()
-print("Add Neuronbridge Hemibrain <-> slide code top 20 scores...")
+# Serial: the has_image and SUBCLASSOF* statements return the same few DataSet and parent
+# nodes on a great many rows, so parallel batches would keep locking the same nodes.
+@pipeline.step("Fixes for scRNAseq DataSets", batch=True)
+def fix_scrnaseq_datasets():
+    pipeline.run_statements([
+        "MATCH (n:DataSet) WHERE n.short_form STARTS WITH 'FBlc' AND NOT (n:hasScRNAseq AND n:scRNAseq_DataSet) SET n:hasScRNAseq SET n:scRNAseq_DataSet",
+        "MATCH (n:DataSet)<-[:has_source]-(:Individual)<-[:depicts]-(:Individual)-[:in_register_with]->(:Template) WHERE NOT n:has_image SET n:has_image",
+        "MATCH (n:Cluster) WHERE EXISTS(n.uniqueFacets) AND NOT 'Cluster' IN n.uniqueFacets SET n.uniqueFacets= n.uniqueFacets + 'Cluster'",
+        "MATCH (primary:Individual:Cluster)-[e:expresses]->(g:Gene:Class) WHERE NOT g:hasScRNAseq SET g:hasScRNAseq",
+        "MATCH (parent:Cell)<-[:SUBCLASSOF*]-(primary:Class)<-[:composed_primarily_of]-(c:Cluster)-[:has_source]->(ds:scRNAseq_DataSet) WHERE NOT (primary:hasScRNAseq AND parent:hasScRNAseq) SET primary:hasScRNAseq SET parent:hasScRNAseq"
+    ])
+
+
+# Whole-graph updates like this are run as batched iterate jobs (see executor.py)
+# so a failing batch is retried on its own rather than rolling back the whole graph.
+@pipeline.step("Remove any unique facet duplicates", conflicts=OWN_NODE, batch=True)
+def dedupe_unique_facets():
+    pipeline.run_statements([
+        "MATCH (n) WHERE EXISTS(n.uniqueFacets) AND NOT SIZE(n.uniqueFacets) = SIZE(apoc.coll.toSet(n.uniqueFacets)) "
+        "SET n.uniqueFacets = apoc.coll.toSet(n.uniqueFacets)"
+    ])
+
+
+@pipeline.step("Expand term_replace_by parameter into edge links")
+def expand_term_replaced_by():
+    pipeline.commit([
+        "MATCH (n:Deprecated) WHERE EXISTS(n.term_replaced_by) AND NOT (n)-[:term_replaced_by]->() WITH n, REPLACE(n.term_replaced_by[0], ':', '_') AS id MATCH (r {short_form: id}) MERGE (n)-[t:term_replaced_by]->(r) ON CREATE SET t.iri = 'http://purl.obolibrary.org/obo/IAO_0100001', t.short_form = 'IAO_0100001', t.type = 'Annotation', t.label = 'term replaced by'"
+    ])
+
+
+@pipeline.step("Fix targeted schema issues", batch=True)
+def fix_schema_issues():
+    # Relationship property fixes (pub, typ, licence, expression_level) are declared as rules
+    # in normalization.py and applied with one relationship pass per relationship type group.
+    pipeline.normalize()
+    pipeline.run_statements([
+        "MATCH (n:pub) WHERE n.short_form STARTS WITH 'FBrf' AND NOT EXISTS(n.FlyBase) SET n.FlyBase = [n.short_form]",
+        "MATCH (n:pub) WHERE EXISTS(n.FlyBase) AND NOT n.FlyBase = [] + n.FlyBase SET n.FlyBase = [] + n.FlyBase"
+    ])
 
-vc.nc.commit_list([
-    """
-    LOAD CSV WITH HEADERS FROM 'file:///top20_scores_agg_short_forms.tsv' AS row 
-    FIELDTERMINATOR '\\t'
-    MATCH (s:Individual {short_form: row.`n.short_form_x`}), (b:Individual {short_form: row.`n.short_form_y`})
-    WITH s, b, row.score as score
-    OPTIONAL MATCH (s)-[r:has_similar_morphology_to_part_of]-(b)
-    WITH s, b, r, score
-    FOREACH (ignoreMe IN CASE WHEN r IS NULL THEN [1] ELSE [] END |
-        MERGE (s)-[r:has_similar_morphology_to_part_of {
-            iri: "http://n2o.neo/custom/has_similar_morphology_to_part_of",
-            short_form: "has_similar_morphology_to_part_of",
-            type: "Annotation",
-            neuronbridge_score: [score]
-        }]->(b)
-    )
-    WITH s, b, r, score
-    SET r.neuronbridge_score = [score]
-    SET s:neuronbridge, b:neuronbridge
-    RETURN count(*) as relationships_processed;
-    """
-])
-
-stop = timeit.default_timer()
-print('Run time: ', stop - start)
-
-
-# Start monitoring after executing all commit_list statements
-start_monitor = timeit.default_timer()
-monitor_apoc_jobs()
-stop_monitor = timeit.default_timer()
-print('Monitoring Run time: ', stop_monitor - start_monitor, 'seconds')
-
-
-# Add any missing unique facets
-start = timeit.default_timer()
-print("Add any missing unique facets...")
-vc.nc.commit_list(statements=[
-    "MATCH (n:Deprecated) WHERE NOT EXISTS(n.uniqueFacets) AND NOT n.short_form STARTS WITH 'VFBc_' SET n.uniqueFacets=['Deprecated']",
-    "MATCH (n:Deprecated) WHERE EXISTS(n.uniqueFacets) AND NOT n.short_form STARTS WITH 'VFBc_' AND NOT 'Deprecated' IN n.uniqueFacets SET n.uniqueFacets=n.uniqueFacets + ['Deprecated']",
-    "MATCH (n:DataSet) WHERE NOT EXISTS(n.uniqueFacets) AND NOT n.short_form STARTS WITH 'VFBc_' SET n.uniqueFacets=['DataSet']",
-    "MATCH (n:pub) WHERE NOT EXISTS(n.uniqueFacets) AND NOT n.short_form STARTS WITH 'VFBc_' SET n.uniqueFacets=['pub']",
-    "MATCH (n:Person) WHERE NOT EXISTS(n.uniqueFacets) AND NOT n.short_form STARTS WITH 'VFBc_' SET n.uniqueFacets=['Person']",
-    "MATCH (n:Site) WHERE NOT EXISTS(n.uniqueFacets) AND NOT n.short_form STARTS WITH 'VFBc_' SET n.uniqueFacets=['Site']",
-    "MATCH (n:API) WHERE NOT EXISTS(n.uniqueFacets) AND NOT n.short_form STARTS WITH 'VFBc_' SET n.uniqueFacets=['API']",
-    "MATCH (n:License) WHERE NOT EXISTS(n.uniqueFacets) AND NOT n.short_form STARTS WITH 'VFBc_' SET n.uniqueFacets=['License']",
-    "MATCH (n:Expression_pattern:Split) WHERE NOT EXISTS(n.uniqueFacets) AND NOT n.short_form STARTS WITH 'VFBc_' SET n.uniqueFacets=['Expression_pattern','Split']",
-    "MATCH (n:Expression_pattern) WHERE NOT EXISTS(n.uniqueFacets) AND NOT n.short_form STARTS WITH 'VFBc_' SET n.uniqueFacets=['Expression_pattern']",
-    "MATCH (n:Class) WHERE NOT EXISTS(n.uniqueFacets) AND n.short_form STARTS WITH 'FBtp' SET n.uniqueFacets=['Transgenic_Construct']",
-    "MATCH (n:Class) WHERE NOT EXISTS(n.uniqueFacets) AND n.short_form STARTS WITH 'FBti' SET n.uniqueFacets=['Insertion']",
-    "MATCH (n:Class) WHERE NOT EXISTS(n.uniqueFacets) AND n.short_form STARTS WITH 'FBal' SET n.uniqueFacets=['Allele']",
-    "MATCH (n:Class) WHERE NOT EXISTS(n.uniqueFacets) AND n.short_form STARTS WITH 'FBgn' SET n.uniqueFacets=['Gene']",
-    "MATCH (n:Class) WHERE NOT EXISTS(n.uniqueFacets) AND n.short_form STARTS WITH 'FBrf' SET n.uniqueFacets=['FB_Reference']",
-    "MATCH (n:Class) WHERE NOT EXISTS(n.uniqueFacets) AND n.short_form STARTS WITH 'FBim' SET n.uniqueFacets=['FB_Image']",
-    "MATCH (n:Class) WHERE NOT EXISTS(n.uniqueFacets) AND n.short_form STARTS WITH 'FBdv' SET n.uniqueFacets=['Stage']",
-    "MATCH (n:Class) WHERE n.short_form STARTS WITH 'FBdv' SET n:Stage",
-    "MATCH (n:Class) WHERE n.short_form STARTS WITH 'FBgn' SET n:Gene",
-    "MATCH (n:Class) WHERE NOT EXISTS(n.uniqueFacets) SET n.uniqueFacets=['Class']",
-    "MATCH (n:Split) WHERE EXISTS(n.uniqueFacets) AND NOT n.short_form STARTS WITH 'VFBc_' AND NOT 'Split' IN n.uniqueFacets SET n.uniqueFacets=n.uniqueFacets + ['Split']"
-])
-stop = timeit.default_timer()
-print('Run time: ', stop - start)
-
-# Fixes for scRNAseq DataSets
-start = timeit.default_timer()
-print("Fixes for scRNAseq DataSets...")
-vc.nc.commit_list(statements=[
-    "MATCH (n:DataSet) WHERE n.short_form STARTS WITH 'FBlc' SET n:hasScRNAseq SET n:scRNAseq_DataSet",
-    "MATCH (n:DataSet)<-[:has_source]-(:Individual)<-[:depicts]-(:Individual)-[:in_register_with]->(:Template) SET n:has_image",
-    "MATCH (a)-[r1:licence]->(l:License) MERGE (a)-[r2:has_license]->(l) ON CREATE SET r2=r1 SET r2.label='has_license' DELETE r1",
-    "MATCH (n:Cluster) WHERE EXISTS(n.uniqueFacets) AND NOT 'Cluster' IN n.uniqueFacets SET n.uniqueFacets= n.uniqueFacets + 'Cluster'",
-    "MATCH (primary:Individual:Cluster)-[e:expresses]->(g:Gene:Class) SET g:hasScRNAseq",
-    "MATCH (parent:Cell)<-[:SUBCLASSOF*]-(primary:Class)<-[:composed_primarily_of]-(c:Cluster)-[:has_source]->(ds:scRNAseq_DataSet) SET primary:hasScRNAseq SET parent:hasScRNAseq",
-    """
-    MATCH ()-[r:expresses]->()
-    WHERE EXISTS(r.expression_level)
-    WITH r, SPLIT(TOSTRING(r.expression_level[0]), '.') AS parts
-    WITH SIZE(parts[0]) AS beforeDecimalLength, SIZE(parts[1]) AS afterDecimalLength, r
-    WITH MAX(beforeDecimalLength) AS maxBeforeDecimal, MAX(afterDecimalLength) AS maxAfterDecimal, COLLECT(r) AS relationships
-    UNWIND relationships AS r
-    WITH maxBeforeDecimal, maxAfterDecimal, r, SPLIT(TOSTRING(r.expression_level[0]), '.') AS parts
-    WITH maxBeforeDecimal, maxAfterDecimal, r, parts,
-         apoc.text.lpad(parts[0], maxBeforeDecimal, '0') AS beforeDecimalPadded,
-         apoc.text.rpad(parts[1], maxAfterDecimal, '0') AS afterDecimalPadded
-    SET r.expression_level_padded = [beforeDecimalPadded + '.' + afterDecimalPadded]
-    """
-])
-stop = timeit.default_timer()
-print('Run time: ', stop - start)
-
-# Remove any unique facet duplicates
-start = timeit.default_timer()
-print("Remove any unique facet duplicates...")
-vc.nc.commit_list(statements=[
-    "MATCH (n) WHERE EXISTS(n.uniqueFacets) SET n.uniqueFacets = apoc.coll.toSet(n.uniqueFacets)"
-])
-stop = timeit.default_timer()
-print('Run time: ', stop - start)
-
-# Expand term_replace_by parameter into edge links
-start = timeit.default_timer()
-print("Expand term_replace_by parameter into edge links...")
-vc.nc.commit_list(statements=[
-    "MATCH (n:Deprecated) WHERE EXISTS(n.term_replaced_by) AND NOT (n)-[:term_replaced_by]->() WITH n, REPLACE(n.term_replaced_by[0], ':', '_') AS id MATCH (r {short_form: id}) MERGE (n)-[t:term_replaced_by]->(r) ON CREATE SET t.iri = 'http://purl.obolibrary.org/obo/IAO_0100001', t.short_form = 'IAO_0100001', t.type = 'Annotation', t.label = 'term replaced by'"
-])
-stop = timeit.default_timer()
-print('Run time: ', stop - start)
-
-# Fix targeted schema issues
-start = timeit.default_timer()
-print("Fix targeted schema issues...")
-vc.nc.commit_list(statements=[
-    "MATCH ()-[r]->() WHERE EXISTS(r.pub) SET r.pub = r.pub + []",
-    "MATCH ()-[r]->() WHERE EXISTS(r.typ) SET r.typ = (r.typ + [])[0]",
-    "MATCH (n:pub) WHERE n.short_form STARTS WITH 'FBrf' AND NOT EXISTS(n.FlyBase) SET n.FlyBase = [n.short_form]",
-    "MATCH (n:pub) WHERE EXISTS(n.FlyBase) SET n.FlyBase = [] + n.FlyBase"
-])
-stop = timeit.default_timer()
-print('Run time: ', stop - start)
-
-# Fix xref labels being used instead of label_rdfs
-start = timeit.default_timer()
-print("Fix xref labels being used instead of label_rdfs...")
-vc.nc.commit_list(statements=[
-    "MATCH (n) WHERE n.short_form = n.label AND EXISTS(n.label_rdfs) AND NOT n.label_rdfs[0] = n.label SET n.label=n.label_rdfs[0]",
-    "MATCH (c:Class) WHERE c.label STARTS WITH 'wiki' AND EXISTS(c.label_rdfs) SET c.label = c.label_rdfs[0]",
-    "MATCH (c:Class) WHERE c.short_form STARTS WITH 'GO_' AND NOT c.label = c.label_rdfs[0] SET c.label = c.label_rdfs[0]"
-])
-stop = timeit.default_timer()
-print('Run time: ', stop - start)
-
-
-# Create a list of Cypher statements for lineage_0 to lineage_30
-start = timeit.default_timer()
-print("Adding numerical lineage labels...")
-lineage_statements = []
-for i in range(31):  # 0 to 30 inclusive
-    lineage_label = f"lineage_{i}"
-    lineage_statements.append(
-        f"MATCH (n:{lineage_label}) WHERE EXISTS(n.uniqueFacets) AND NOT '{lineage_label}' IN n.uniqueFacets "
-        f"SET n.uniqueFacets = n.uniqueFacets + ['{lineage_label}']"
-    )
-    lineage_statements.append(
-        f"MATCH (n:{lineage_label}) WHERE NOT EXISTS(n.uniqueFacets) SET n.uniqueFacets = ['{lineage_label}']"
-    )
 
-# Execute the lineage label statements
-vc.nc.commit_list(statements=lineage_statements)
-stop = timeit.default_timer()
-print('Run time: ', stop - start)
-
-# Add official named lineage labels to uniqueFacets
-start = timeit.default_timer()
-print("Adding official named lineage labels...")
-
-# First, query all class labels ending with " lineage neuron"
-query = """
-MATCH (n:Class) WHERE n.label ENDS WITH ' lineage neuron' 
-RETURN DISTINCT n.label as label
-"""
-named_lineages_result = vc.nc.commit_list(statements=[query])
-
-# Transform results and create update statements
-named_lineage_statements = []
-if named_lineages_result and 'data' in named_lineages_result[0] and named_lineages_result[0]['data']:
-    for record in named_lineages_result[0]['data']:
-        # Extract the lineage name (remove " lineage neuron" suffix)
-        lineage_name = record['row'][0].replace(' lineage neuron', '')
-        # Create the new format: lineage_X
-        lineage_label = f"lineage_{lineage_name}"
-        
-        # Create statements to update uniqueFacets, using backticks to escape special characters
-        named_lineage_statements.append(
-            f"MATCH (n:`{lineage_label}`) WHERE EXISTS(n.uniqueFacets) AND NOT '{lineage_label}' IN n.uniqueFacets "
+@pipeline.step("Fix xref labels being used instead of label_rdfs", conflicts=OWN_NODE, batch=True)
+def fix_xref_labels():
+    pipeline.run_statements([
+        "MATCH (n) WHERE n.short_form = n.label AND EXISTS(n.label_rdfs) AND NOT n.label_rdfs[0] = n.label SET n.label=n.label_rdfs[0]",
+        "MATCH (c:Class) WHERE c.label STARTS WITH 'wiki' AND EXISTS(c.label_rdfs) AND NOT c.label = c.label_rdfs[0] SET c.label = c.label_rdfs[0]",
+        "MATCH (c:Class) WHERE c.short_form STARTS WITH 'GO_' AND NOT c.label = c.label_rdfs[0] SET c.label = c.label_rdfs[0]"
+    ])
+
+
+@pipeline.step("Adding numerical lineage labels", conflicts=OWN_NODE, batch=True)
+def add_lineage_labels():
+    # Create a list of Cypher statements for lineage_0 to lineage_30
+    lineage_statements = []
+    for i in range(31):  # 0 to 30 inclusive
+        lineage_label = f"lineage_{i}"
+        lineage_statements.append(
+            f"MATCH (n:{lineage_label}) WHERE EXISTS(n.uniqueFacets) AND NOT '{lineage_label}' IN n.uniqueFacets "
             f"SET n.uniqueFacets = n.uniqueFacets + ['{lineage_label}']"
         )
-        named_lineage_statements.append(
-            f"MATCH (n:`{lineage_label}`) WHERE NOT EXISTS(n.uniqueFacets) SET n.uniqueFacets = ['{lineage_label}']"
+        lineage_statements.append(
+            f"MATCH (n:{lineage_label}) WHERE NOT EXISTS(n.uniqueFacets) SET n.uniqueFacets = ['{lineage_label}']"
         )
 
-# Execute the named lineage label statements
-if named_lineage_statements:
-    vc.nc.commit_list(statements=named_lineage_statements)
-    
-stop = timeit.default_timer()
-print('Run time: ', stop - start)
-
-# Start monitoring after executing all commit_list statements
-start_monitor = timeit.default_timer()
-monitor_apoc_jobs()
-stop_monitor = timeit.default_timer()
-print('Monitoring Run time: ', stop_monitor - start_monitor, 'seconds')
+    # Execute the lineage label statements
+    pipeline.run_statements(lineage_statements)
+
+
+@pipeline.step("Adding official named lineage labels", conflicts=OWN_NODE, batch=True)
+def add_named_lineage_labels():
+    # First, query all class labels ending with " lineage neuron"
+    query = """
+    MATCH (n:Class) WHERE n.label ENDS WITH ' lineage neuron'
+    RETURN DISTINCT n.label as label
+    """
+    named_lineages_result = pipeline.commit([query])
+
+    # Transform results and create update statements
+    named_lineage_statements = []
+    if named_lineages_result and 'data' in named_lineages_result[0] and named_lineages_result[0]['data']:
+        for record in named_lineages_result[0]['data']:
+            # Extract the lineage name (remove " lineage neuron" suffix)
+            lineage_name = record['row'][0].replace(' lineage neuron', '')
+            # Create the new format: lineage_X
+            lineage_label = f"lineage_{lineage_name}"
+
+            # Create statements to update uniqueFacets, using backticks to escape special characters
+            named_lineage_statements.append(
+                f"MATCH (n:`{lineage_label}`) WHERE EXISTS(n.uniqueFacets) AND NOT '{lineage_label}' IN n.uniqueFacets "
+                f"SET n.uniqueFacets = n.uniqueFacets + ['{lineage_label}']"
+            )
+            named_lineage_statements.append(
+                f"MATCH (n:`{lineage_label}`) WHERE NOT EXISTS(n.uniqueFacets) SET n.uniqueFacets = ['{lineage_label}']"
+            )
+
+    # Execute the named lineage label statements
+    if named_lineage_statements:
+        pipeline.run_statements(named_lineage_statements)
+
+    # Start monitoring after executing all commit_list statements
+    pipeline.monitor()
+
+
+if __name__ == "__main__":
+    raise SystemExit(pipeline.main())
@@ -0,0 +1,163 @@
+from executor import BATCH_SIZE, BATCH_RETRIES, iterate_statement, report_batches
+
+# Relationship property normalization rules.
+# Each rule declares the relationship types it touches (None = every type), the
+# relationship properties it rewrites, a 'where' predicate and an 'update'. Only
+# relationships that have every listed property are visited, and 'where' then only
+# matches those the update would change, so passes can be rerun and the change log
+# only records real changes. Inside 'where' and 'update' the relationship is bound to r
+# and its start and end nodes to s and e.
+# 'prepare' is an optional read-only query returning a single row, whose columns are
+# passed to 'where' and 'update' as $parameters. Rules that replace r with a new
+# relationship set 'creates', so the change log records the nodes at either end as well as r.
+# Rules that touch the same relationship types are fused into one streamed pass.
+PADDED_EXPRESSION_LEVEL = (
+    "[apoc.text.lpad(SPLIT(TOSTRING(r.expression_level[0]), '.')[0], $maxBeforeDecimal, '0') + '.' + "
+    "apoc.text.rpad(SPLIT(TOSTRING(r.expression_level[0]), '.')[1], $maxAfterDecimal, '0')]"
+)
+RELATIONSHIP_RULES = [
+    {
+        "name": "pub as list",
+        "types": None,
+        "properties": ["pub"],
+        "where": "NOT r.pub = r.pub + []",
+        "update": "SET r.pub = r.pub + []",
+    },
+    {
+        "name": "typ as single value",
+        "types": None,
+        "properties": ["typ"],
+        "where": "NOT r.typ = (r.typ + [])[0]",
+        "update": "SET r.typ = (r.typ + [])[0]",
+    },
+    {
+        "name": "licence to has_license",
+        "types": ["licence"],
+        "properties": [],
+        "where": "e:License",
+        "update": "MERGE (s)-[r2:has_license]->(e) ON CREATE SET r2 = r SET r2.label = 'has_license' DELETE r",
+        "creates": True,
+    },
+    {
+        "name": "padded expression_level",
+        "types": ["expresses"],
+        "properties": ["expression_level"],
+        "where": "NOT coalesce(r.expression_level_padded, []) = " + PADDED_EXPRESSION_LEVEL,
+        "prepare": (
+            "MATCH ()-[r:expresses]->() WHERE EXISTS(r.expression_level) "
+            "WITH SPLIT(TOSTRING(r.expression_level[0]), '.') AS parts "
+            "RETURN MAX(SIZE(parts[0])) AS maxBeforeDecimal, MAX(SIZE(parts[1])) AS maxAfterDecimal"
+        ),
+        "update": "SET r.expression_level_padded = " + PADDED_EXPRESSION_LEVEL,
+    },
+]
+
+
+def group_rules(rules):
+    """
+    Group rules that touch the same relationship types, keeping declaration order.
+
+    :return: A list of (types, rules) pairs, where types is a sorted tuple or None for every type.
+    """
+    groups = {}
+    for rule in rules:
+        key = tuple(sorted(rule["types"])) if rule["types"] else None
+        groups.setdefault(key, []).append(rule)
+    return list(groups.items())
+
+
+def rule_predicate(rule):
+    """A rule's full predicate: its properties exist and its 'where' holds."""
+    return " AND ".join(["EXISTS(r.%s)" % prop for prop in rule["properties"]] + [rule["where"]])
+
+
+def group_match(types, rules):
+    """The MATCH ... WHERE read half of a group's pass, binding s, r and e."""
+    pattern = "MATCH (s)-[r" + (":" + "|".join(types) if types else "") + "]->(e)"
+    if len(rules) == 1:
+        return pattern + " WHERE " + rule_predicate(rules[0])
+    return pattern + " WHERE " + " OR ".join("(" + rule_predicate(rule) + ")" for rule in rules)
+
+
+def fused_statement(types, rules, params=None, batch_size=BATCH_SIZE, retries=BATCH_RETRIES):
+    """
+    Build one apoc.periodic.iterate job applying every rule in a group in a single pass.
+
+    Each relationship is matched once; every rule's update is guarded by its own predicate,
+    so the pass only visits relationships at least one of the rules applies to.
+    """
+    if len(rules) == 1:
+        update = rules[0]["update"]
+    else:
+        update = " ".join(
+            "FOREACH (_ IN CASE WHEN " + rule_predicate(rule) + " THEN [1] ELSE [] END | " + rule["update"] + ")"
+            for rule in rules
+        )
+    return iterate_statement(group_match(types, rules) + " RETURN s, r, e", update, batch_size, retries,
+                             params=params)
+
+
+def prepare_params(nc, rules):
+    """Run each rule's 'prepare' query and collect the returned columns as parameters."""
+    params = {}
+    for rule in rules:
+        if not rule.get("prepare"):
+            continue
+        result = nc.commit_list(statements=[rule["prepare"]])
+        if result and result[0]['data']:
+            params.update(zip(result[0]['columns'], result[0]['data'][0]['row']))
+    return params
+
+
+def normalize_relationships(nc, rules=RELATIONSHIP_RULES, batch_size=BATCH_SIZE, retries=BATCH_RETRIES,
+                            capture=None):
+    """
+    Apply relationship normalization rules with one streamed pass per group of relationship types.
+
+    :param nc: A Neo4jConnect instance (e.g. vc.nc).
+    :param rules: Rules in the format of RELATIONSHIP_RULES.
+    :param batch_size: Number of relationships updated per transaction.
+    :param retries: Number of times a failed batch is retried before it is reported.
+    :param capture: Optional callable taking (read, variables, params), called before each pass so
+                    the relationships it is about to change can be recorded (see Pipeline.capture).
+    :return: True if every pass succeeded, False otherwise.
+    """
+    ok = True
+    for types, group in group_rules(rules):
+        properties = sorted({prop for rule in group for prop in rule["properties"]})
+        print("Normalizing %s relationships%s: %s" % (
+            "|".join(types) if types else "all", " (" + ", ".join(properties) + ")" if properties else "",
+            ", ".join(rule["name"] for rule in group)))
+        params = prepare_params(nc, group)
+        if capture:
+            variables = ["s", "r", "e"] if any(rule.get("creates", False) for rule in group) else ["r"]
+            capture(group_match(types, group), variables, params)
+        statement = fused_statement(types, group, params, batch_size, retries)
+        ok = report_batches(nc.commit_list(statements=[statement]), statement) and ok
+    return ok
+
+
+def score_rules(as_list=False):
+    """
+    Rules converting NBLAST and NeuronBridge scores loaded as strings into numbers.
+
+    Both rules declare the same relationship types so they share one pass. Edges already
+    in the target form compare equal to their converted value and are skipped, so the
+    conversion can safely be rerun.
+
+    :param as_list: Store each score as a single-element numeric list ([0.5]) for consumers
+                    that still expect the list form, instead of a plain number (0.5).
+    """
+    rules = []
+    for prop in ("NBLAST_score", "neuronbridge_score"):
+        value = "toFloat(apoc.coll.flatten([r.%s])[0])" % prop
+        if as_list:
+            value = "[" + value + "]"
+        rules.append({
+            "name": prop + " as " + ("numeric list" if as_list else "number"),
+            "types": ["has_similar_morphology_to", "has_similar_morphology_to_part_of"],
+            "properties": [prop],
+            "where": "NOT r.%s = %s" % (prop, value),
+            "update": "SET r.%s = %s" % (prop, value),
+        })
+    return rules
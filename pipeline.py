@@ -0,0 +1,363 @@
+import argparse
+import time
+import timeit
+from collections import namedtuple
+
+from changelog import ChangeLog, capture_statement
+from executor import BATCH_SIZE, PARALLEL_SAFE, detach_deleted, may_write, run_iterate, run_statements, split_writes
+from normalization import RELATIONSHIP_RULES, normalize_relationships
+
+# conflicts is the write-conflict class of the step (see executor.py), or None to run serially;
+# batch is True if the step's run_statements updates are run as batched iterate jobs;
+# optional steps (e.g. one-time migrations) only run when named with --only
+Step = namedtuple('Step', ['name', 'description', 'func', 'conflicts', 'batch', 'optional'])
+
+
+class DryRunConnection:
+    """Stands in for Neo4jConnect when no statements should reach the server; prints them instead."""
+
+    def commit_list(self, statements, return_graphs=False):
+        for statement in statements:
+            print("[dry-run] " + " ".join(statement.split()))
+        return [{'columns': [], 'data': []} for _ in statements]
+
+
+# Monitoring function for running APOC periodic jobs
+def is_apoc_jobs_running(nc):
+    query = """
+    CALL dbms.listQueries()
+    YIELD query, status
+    WHERE status = 'running' AND (query CONTAINS 'apoc.periodic.iterate' OR query CONTAINS 'LOAD CSV')
+    RETURN COUNT(*) AS running
+    """
+    try:
+        result = nc.commit_list(statements=[query])
+        # Parsing the result based on the expected response structure
+        if result and 'data' in result[0] and result[0]['data']:
+            # Extract the count from the first row
+            running_count = result[0]['data'][0]['row'][0]
+            return running_count > 1
+        return False
+    except Exception as e:
+        print(f"Error while checking APOC jobs: {e}")
+        # Decide whether to treat this as running or not based on your requirements
+        return True  # Assume jobs are running if there's an error
+
+
+def monitor_apoc_jobs(nc, check_interval=1800, max_wait_time=864000):
+    """
+    Monitor APOC periodic jobs and wait until all running jobs have completed.
+
+    :param nc: A Neo4jConnect instance (e.g. vc.nc).
+    :param check_interval: Time in seconds between checks (default: 1800 seconds = 30 minutes)
+    :param max_wait_time: Maximum time in seconds to wait before aborting (default: 86400 seconds = 24 hours)
+    """
+    print("Monitoring for running APOC periodic jobs...")
+    start_time = time.time()
+    try:
+        while True:
+            if is_apoc_jobs_running(nc):
+                elapsed = time.time() - start_time
+                if elapsed > max_wait_time:
+                    print("Maximum wait time exceeded. Exiting monitoring.")
+                    break
+                minutes = check_interval // 60
+                print(f"An APOC periodic job is still running. Checking again in {minutes} minutes...")
+                time.sleep(check_interval)
+            else:
+                print("No APOC periodic jobs are running. Exiting monitoring.")
+                break
+    except KeyboardInterrupt:
+        print("Monitoring interrupted by user. Exiting.")
+
+
+class Pipeline:
+    """
+    An ordered set of named steps sharing one lazily opened connection.
+
+    Steps are registered with the step decorator and run in registration order. The
+    connection is only opened the first time a step uses nc, so importing a script,
+    listing its steps or doing a dry run never contacts the server. A step fails if any
+    statement or batch it ran through commit, run_statements, iterate or normalize failed;
+    later steps still run, and main() exits non-zero naming the failed steps.
+    """
+
+    def __init__(self, name, connect):
+        """
+        :param name: Name shown in the command-line help.
+        :param connect: Callable returning a VfbConnect instance; called on first use of nc.
+        """
+        self.name = name
+        self.connect = connect
+        self.steps = []
+        self.dry_run = False
+        self.workers = 1
+        self.batch_size = BATCH_SIZE
+        self.current = None
+        self.changelog = None
+        self.failed = []
+        self.options = {}
+        self._ok = True
+        self._nc = None
+        self._arguments = []
+
+    def step(self, description, conflicts=None, batch=False, optional=False):
+        """
+        Register the decorated function as the next step of the pipeline.
+
+        :param description: Printed when the step runs and shown by --list.
+        :param conflicts: Write-conflict class of the step's batched jobs (LABEL_ONLY, OWN_NODE or
+                          RELATIONSHIP from executor.py); None keeps them serial.
+        :param batch: Run every statement the step passes to run_statements as a batched iterate
+                      job; only for 'MATCH ... SET ...' updates that are safe to apply twice.
+        :param optional: Leave the step out unless it is named with --only.
+        """
+        def register(func):
+            self.steps.append(Step(func.__name__, description, func, conflicts, batch, optional))
+            return func
+        return register
+
+    def add_option(self, *flags, **kwargs):
+        """
+        Add a script-specific command-line option (argparse.add_argument arguments).
+
+        Its value is available as options[dest] straight away, holding the default until main()
+        parses the command line, so steps can read it whether or not they run from main().
+        """
+        dest = kwargs.get('dest') or flags[0].lstrip('-').replace('-', '_')
+        self._arguments.append((flags, kwargs))
+        self.options[dest] = kwargs.get('default')
+
+    @property
+    def conflicts(self):
+        return self.current.conflicts if self.current else None
+
+    @property
+    def nc(self):
+        if self._nc is None:
+            self._nc = DryRunConnection() if self.dry_run else self.connect().nc
+        return self._nc
+
+    def _check(self, ok):
+        """Note a failed statement or job against the current step."""
+        if not ok:
+            self._ok = False
+        return ok
+
+    def capture(self, read, variables, params=None, detached=()):
+        """
+        Record the nodes and relationships a write is about to change in the change log, if one is kept.
+
+        Called before the write, so deleted entities can still be read. Steps whose statements
+        cannot be split automatically (e.g. prebuilt apoc.periodic.iterate jobs) call it (or
+        record) directly and commit them with captured=True.
+
+        :param read: MATCH (and WHERE) part of a query binding the entities, without RETURN.
+        :param variables: Variables bound by read to record.
+        :param params: Dict of values read uses as $parameters.
+        :param detached: Variables the write removes with DETACH DELETE, whose relationships and
+                         neighbours are recorded too.
+        """
+        if self.changelog is None or not variables:
+            return True
+        return self.record(capture_statement(read, variables, detached), params)
+
+    def capture_changes(self, statement):
+        """
+        Record what a single statement is about to change, splitting it at its first write clause.
+
+        A statement that may write but cannot be split (one starting with MERGE or CALL) fails
+        the step rather than silently leaving its changes out of the changeset; record them
+        with capture or record and commit it with captured=True instead.
+        """
+        if self.changelog is None:
+            return True
+        target = split_writes(statement)
+        if target:
+            return self.capture(*target, detached=detach_deleted(statement))
+        if may_write(statement):
+            print("Change log cannot tell what this statement changes; record it with capture or record "
+                  f"and commit it with captured=True: {' '.join(statement.split())}")
+            return self._check(False)
+        return True
+
+    def record(self, query, params=None):
+        """
+        Export the (kind, key) rows of a query to the change log, if one is kept.
+
+        A failed export fails the step, since the changeset would otherwise silently miss changes.
+
+        :param query: Query returning kind and key columns, sorted (see changelog.capture_statement).
+        :param params: Dict of values the query uses as $parameters.
+        """
+        if self.changelog is None:
+            return True
+        if not self.changelog.export(self.nc, self.current.name, query, params):
+            print("Change log capture failed; the changeset will be incomplete")
+            return self._check(False)
+        return True
+
+    def commit(self, statements, captured=False):
+        """
+        Commit statements as-is in a single transaction.
+
+        When a change log is kept each statement is captured and committed on its own, so the
+        capture only sees rows left unchanged by the statements before it.
+
+        :param captured: The step already recorded what the statements change (see capture_changes).
+        """
+        if self.changelog is None:
+            result = self.nc.commit_list(statements=statements)
+            self._check(result is not False)
+            return result
+        results = []
+        for statement in statements:
+            if not captured:
+                self.capture_changes(statement)
+            result = self.nc.commit_list(statements=[statement])
+            if not self._check(result is not False):
+                return False
+            results.extend(result)
+        return results
+
+    def run_statements(self, statements, batch=None):
+        """
+        Commit statements, as batched iterate jobs if the step opted in (see executor.run_statements).
+
+        :param batch: Overrides the step's batch flag for these statements.
+        """
+        if batch is None:
+            batch = self.current.batch if self.current else False
+        return self._check(run_statements(self.nc, statements, batch=batch, batch_size=self.batch_size,
+                                          parallel=self.workers > 1 and self.conflicts in PARALLEL_SAFE,
+                                          concurrency=self.workers,
+                                          capture=self.capture_changes if self.changelog is not None else None))
+
+    def iterate(self, match, returns, update, batch_size=None, nodes=None):
+        """
+        Run an apoc.periodic.iterate job using the current step's write-conflict class.
+
+        :param match: MATCH (and WHERE) part of the read query, without RETURN.
+        :param returns: Comma-separated variables returned to the update.
+        :param update: Update applied to each batch of rows.
+        :param batch_size: Rows per transaction (default: the pipeline batch size).
+        :param nodes: Node variables to partition on for RELATIONSHIP steps.
+        """
+        self.capture(match, [name.strip() for name in returns.split(',')], detached=detach_deleted(update))
+        return self._check(run_iterate(self.nc, match, returns, update, conflicts=self.conflicts, nodes=nodes,
+                                       workers=self.workers, batch_size=batch_size or self.batch_size))
+
+    def normalize(self, rules=RELATIONSHIP_RULES):
+        """Apply relationship normalization rules (see normalization.normalize_relationships)."""
+        return self._check(normalize_relationships(self.nc, rules, batch_size=self.batch_size,
+                                                   capture=self.capture))
+
+    def monitor(self):
+        """Wait for any running APOC periodic jobs to complete."""
+        if self.dry_run:
+            return
+        start_monitor = timeit.default_timer()
+        monitor_apoc_jobs(self.nc)
+        stop_monitor = timeit.default_timer()
+        print('Monitoring Run time: ', stop_monitor - start_monitor, 'seconds')
+
+    def _index(self, name):
+        names = [step.name for step in self.steps]
+        if name.isdigit() and 1 <= int(name) <= len(names):
+            return int(name) - 1
+        if name not in names:
+            raise ValueError(f"Unknown step '{name}'. Use --list to see available steps.")
+        return names.index(name)
+
+    def select(self, only=None, start=None, until=None):
+        """
+        Choose steps by name or 1-based position, keeping pipeline order.
+
+        :param only: Names of the steps to run; all steps but the optional ones if empty.
+        :param start: First step to run (inclusive).
+        :param until: Last step to run (inclusive).
+        :return: A list of Step tuples.
+        """
+        first = self._index(start) if start else 0
+        last = self._index(until) if until else len(self.steps) - 1
+        wanted = {self._index(name) for name in only} if only else None
+        return [step for i, step in enumerate(self.steps)
+                if first <= i <= last and (i in wanted if wanted is not None else not step.optional)]
+
+    def run(self, steps=None):
+        """
+        Run the given steps (all but the optional steps by default), printing the run time of each.
+
+        :return: Names of the steps that failed.
+        """
+        self.failed = []
+        if self.changelog is not None:
+            self.changelog.start([step.name for step in self.steps])
+        for step in self.select() if steps is None else steps:
+            start = timeit.default_timer()
+            print(f"{step.description}...")
+            self.current = step
+            self._ok = True
+            try:
+                step.func()
+            finally:
+                if self.changelog is not None:
+                    count, missing = self.changelog.write_step(step.name)
+                    print(f"Recorded {count} changed entities")
+                    if missing:
+                        print(f"Change log files not found: {', '.join(missing)}")
+                        self._ok = False
+                self.current = None
+            if not self._ok:
+                print(f"Step {step.name} failed")
+                self.failed.append(step.name)
+            stop = timeit.default_timer()
+            print('Run time: ', stop - start)
+        if self.changelog is not None:
+            path, count = self.changelog.merge()
+            print(f"Changeset of {count} entities written to {path}")
+        if self.failed:
+            print(f"Failed steps: {', '.join(self.failed)}; rerun them with --only {','.join(self.failed)}")
+        return self.failed
+
+    def main(self, argv=None):
+        """Command-line entry point."""
+        parser = argparse.ArgumentParser(prog=self.name, description=f"Run the {self.name} pipeline steps.")
+        parser.add_argument('--list', action='store_true', help="list the steps and exit")
+        parser.add_argument('--only', action='append', default=[], metavar='STEP',
+                            help="run only this step (name or number); may be repeated or comma-separated; "
+                                 "optional steps only run when named here")
+        parser.add_argument('--from', dest='start', metavar='STEP', help="start from this step (inclusive)")
+        parser.add_argument('--until', metavar='STEP', help="stop after this step (inclusive)")
+        parser.add_argument('--dry-run', action='store_true',
+                            help="print statements instead of sending them; never connects to the server")
+        parser.add_argument('--workers', type=int, default=1,
+                            help="concurrent batches (label-only/own-node steps) or partitioned jobs "
+                                 "(relationship-creating steps) for APOC periodic jobs (default: 1)")
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE,
+                            help=f"rows per transaction for batched updates (default: {BATCH_SIZE})")
+        parser.add_argument('--changelog', metavar='DIR',
+                            help="record the nodes and relationships each step changes in DIR and merge "
+                                 "them into DIR/changeset.tsv.gz at the end of the run")
+        for flags, kwargs in self._arguments:
+            parser.add_argument(*flags, **kwargs)
+        args = parser.parse_args(argv)
+        self.options = {dest: getattr(args, dest) for dest in self.options}
+
+        if args.list:
+            for i, step in enumerate(self.steps, 1):
+                mode = (step.conflicts or 'serial') + (', batched' if step.batch else '') + \
+                    (', optional' if step.optional else '')
+                print(f"{i:>3}. {step.name:<40} {mode:<31} {step.description}")
+            return 0
+        only = [name.strip() for value in args.only for name in value.split(',') if name.strip()]
+        try:
+            steps = self.select(only, args.start, args.until)
+        except ValueError as e:
+            parser.error(str(e))
+        self.dry_run = args.dry_run
+        self.workers = max(1, args.workers)
+        self.batch_size = args.batch_size
+        if args.changelog:
+            self.changelog = ChangeLog(args.changelog)
+        return 1 if self.run(steps) else 0
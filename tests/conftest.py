@@ -0,0 +1,87 @@
+import re
+from types import SimpleNamespace
+
+import pytest
+
+from pipeline import Pipeline
+
+_EXPORT_PATH = re.compile(r'", "([^"]+)", \{delim')
+
+
+class FakeConnection:
+    """
+    Stands in for Neo4jConnect, keeping every commit_list call.
+
+    :param fail_on: Fail any call with a statement containing this text.
+    :param exports: Lists of (kind, key) rows; each change log export writes the next one to its file.
+    :param fail_exports: Fail every change log export.
+    :param deadlocked: Iterate jobs containing one of these texts deadlock the first time they run.
+    :param answers: Dict mapping text to (columns, row) returned for a statement containing it.
+    """
+
+    def __init__(self, fail_on=None, exports=(), fail_exports=False, deadlocked=(), answers=None):
+        self.fail_on = fail_on
+        self.exports = list(exports)
+        self.fail_exports = fail_exports
+        self.deadlocked = list(deadlocked)
+        self.answers = answers or {}
+        self.calls = []
+
+    @property
+    def statements(self):
+        return [statement for call in self.calls for statement in call]
+
+    def commit_list(self, statements, return_graphs=False):
+        self.calls.append(list(statements))
+        statement = statements[0]
+        if self.fail_on and any(self.fail_on in statement for statement in statements):
+            return False
+        if statement.startswith("CALL apoc.export.csv.query("):
+            return self._export(statement)
+        if statement.startswith("CALL apoc.periodic.iterate("):
+            deadlock = [marker for marker in self.deadlocked if marker in statement]
+            for marker in deadlock:
+                self.deadlocked.remove(marker)
+            errors = {"ForsetiClient can't acquire lock: DeadlockDetected": 1} if deadlock else {}
+            return [{'columns': [], 'data': [{'row': [1, 1, 1 if deadlock else 0, errors]}]}]
+        for text, (columns, row) in self.answers.items():
+            if text in statement:
+                return [{'columns': columns, 'data': [{'row': row}]}]
+        return [{'columns': [], 'data': []} for _ in statements]
+
+    def _export(self, statement):
+        if self.fail_exports:
+            return False
+        rows = sorted(set(self.exports.pop(0))) if self.exports else []
+        with open(_EXPORT_PATH.search(statement).group(1), 'w') as f:
+            f.write("kind\tkey\n" + "".join("%s\t%s\n" % row for row in rows))
+        return [{'columns': ['rows'], 'data': [{'row': [len(rows)]}]}]
+
+
+@pytest.fixture
+def fake_connection():
+    """The FakeConnection class, to build connections with the behaviour a test needs."""
+    return FakeConnection
+
+
+@pytest.fixture
+def make_pipeline():
+    """
+    Build a pipeline whose steps run fixed statements through run_statements.
+
+    Steps are given as (name, statements) or (name, statements, step keyword arguments).
+    A pipeline built without a connection fails the test if it ever connects.
+    """
+    def build(nc, steps):
+        def connect():
+            assert nc is not None, "connected"
+            return SimpleNamespace(nc=nc)
+
+        pipeline = Pipeline("test", connect)
+        for name, statements, *options in steps:
+            def func(statements=statements):
+                pipeline.run_statements(statements)
+            func.__name__ = name
+            pipeline.step(name.replace("_", " ").capitalize(), **(options[0] if options else {}))(func)
+        return pipeline
+    return build
@@ -0,0 +1,92 @@
+import gzip
+
+from changelog import CHANGESET, ChangeLog, capture_statement
+
+STEPS = [
+    ("first", ["MATCH (n:Thing) WHERE NOT n:Other SET n:Other", "MATCH (n:Thing)-[r:old]->(m) DELETE r"]),
+    ("second", ["MATCH (n:Other) WHERE NOT n:Thing SET n:Thing"]),
+]
+
+
+def read_changeset(directory):
+    with gzip.open(str(directory / CHANGESET), 'rt') as f:
+        return f.read().splitlines()
+
+
+def test_capture_statement():
+    assert capture_statement("MATCH (n)-[r]->(m)", ["n", "r"]).startswith(
+        "MATCH (n)-[r]->(m) WITH n, r UNWIND [n, r] AS x ")
+    assert capture_statement("MATCH (n)", ["n"]).endswith("ORDER BY kind, key")
+
+
+def test_capture_statement_detached():
+    assert capture_statement("MATCH (i:Individual)", ["i"], detached=["i"]).startswith(
+        "MATCH (i:Individual) WITH i UNWIND [i] + [(i)-[detached_rel]-(detached_nbr) | detached_rel] "
+        "+ [(i)-[detached_rel]-(detached_nbr) | detached_nbr] AS x ")
+
+
+def test_changeset_merges_steps_sorted_and_deduplicated(tmp_path, fake_connection, make_pipeline):
+    nc = fake_connection(exports=[[('node', 'FBbt_2')], [('relationship', '7'), ('node', 'FBbt_1')],
+                                  [('node', 'FBbt_2'), ('node', 'FBbt_0')]])
+    assert make_pipeline(nc, STEPS).main(["--changelog", str(tmp_path)]) == 0
+    assert read_changeset(tmp_path) == ["node\tFBbt_0", "node\tFBbt_1", "node\tFBbt_2", "relationship\t7"]
+    assert sorted(path.name for path in tmp_path.iterdir()) == [CHANGESET, "first.tsv.gz", "second.tsv.gz"]
+    # Each statement is captured and committed on its own, so later captures see earlier writes
+    commits = [statement for statement in nc.statements if not statement.startswith("CALL")]
+    assert commits == [statements for _, step_statements in STEPS for statements in step_statements]
+
+
+def test_reused_directory_only_holds_this_run(tmp_path, fake_connection, make_pipeline):
+    make_pipeline(fake_connection(exports=[[('node', 'old')]] * 3), STEPS).main(["--changelog", str(tmp_path)])
+    (tmp_path / "first.part9.tsv").write_text("kind\tkey\nnode\tleftover\n")
+    assert make_pipeline(fake_connection(exports=[[('node', 'new')]]), STEPS).main(
+        ["--changelog", str(tmp_path), "--only", "second"]) == 0
+    assert read_changeset(tmp_path) == ["node\tnew"]
+    assert sorted(path.name for path in tmp_path.iterdir()) == [CHANGESET, "second.tsv.gz"]
+
+
+def test_failed_capture_fails_the_step(tmp_path, fake_connection, make_pipeline, capsys):
+    pipeline = make_pipeline(fake_connection(fail_exports=True), STEPS)
+    assert pipeline.main(["--changelog", str(tmp_path)]) == 1
+    assert pipeline.failed == ["first", "second"]
+    assert "Change log capture failed" in capsys.readouterr().out
+
+
+def test_uncapturable_write_fails_the_step(tmp_path, fake_connection, make_pipeline, capsys):
+    nc = fake_connection()
+    pipeline = make_pipeline(nc, [("merge", ["MERGE (p:pub {short_form:'Unattributed'}) SET p:Entity"]),
+                                  ("read", ["MATCH (n) RETURN n.label"])])
+    assert pipeline.main(["--changelog", str(tmp_path)]) == 1
+    assert pipeline.failed == ["merge"]
+    assert "Change log cannot tell what this statement changes" in capsys.readouterr().out
+
+
+def test_captured_commit_is_not_checked(tmp_path, fake_connection, make_pipeline):
+    pipeline = make_pipeline(fake_connection(exports=[[('node', 'Unattributed')]]), [])
+
+    @pipeline.step("Merge")
+    def merge():
+        pipeline.record("RETURN 'node' AS kind, 'Unattributed' AS key")
+        pipeline.commit(["MERGE (p:pub {short_form:'Unattributed'}) SET p:Entity"], captured=True)
+
+    assert pipeline.main(["--changelog", str(tmp_path)]) == 0
+    assert read_changeset(tmp_path) == ["node\tUnattributed"]
+
+
+def test_detach_delete_records_relationships_and_neighbours(tmp_path, fake_connection, make_pipeline):
+    nc = fake_connection()
+    make_pipeline(nc, [("delete", ["MATCH (i:Individual) WHERE i.label = i.short_form DETACH DELETE i"])]).main(
+        ["--changelog", str(tmp_path)])
+    assert "[(i)-[detached_rel]-(detached_nbr) | detached_nbr]" in nc.statements[0]
+
+
+def test_missing_part_file_is_reported(tmp_path):
+    changelog = ChangeLog(str(tmp_path))
+    changelog.start(["first"])
+    changelog.parts.append(str(tmp_path / "first.part0.tsv"))
+    assert changelog.write_step("first") == (0, [str(tmp_path / "first.part0.tsv")])
+
+
+def test_dry_run_records_nothing(tmp_path, make_pipeline):
+    assert make_pipeline(None, STEPS).main(["--dry-run", "--changelog", str(tmp_path)]) == 0
+    assert read_changeset(tmp_path) == []
@@ -0,0 +1,157 @@
+import re
+
+import pytest
+
+from executor import (detach_deleted, may_write, partition_rounds, run_partitioned, run_statements, split_update,
+                      split_writes)
+
+
+@pytest.mark.parametrize("statement, read, update, variables", [
+    ("MATCH (n:Class) WHERE n.short_form STARTS WITH 'FBgn' SET n:Gene",
+     "MATCH (n:Class) WHERE n.short_form STARTS WITH 'FBgn'", "SET n:Gene", ["n"]),
+    ("MATCH (c:Class {short_form:'VFBext_0000010'})<-[:SUBCLASSOF|INSTANCEOF*]-(n) WHERE not n:Expression_pattern "
+     "SET n:Expression_pattern;",
+     "MATCH (c:Class {short_form:'VFBext_0000010'})<-[:SUBCLASSOF|INSTANCEOF*]-(n) WHERE not n:Expression_pattern",
+     "SET n:Expression_pattern", ["n"]),
+    ("MATCH (n) WHERE NOT EXISTS(n.description) AND EXISTS(n.definition) "
+     "WITH n, apoc.convert.fromJsonMap(n.definition[0]) AS def WHERE EXISTS(def.value) SET n.description = [def.value]",
+     "MATCH (n) WHERE NOT EXISTS(n.description) AND EXISTS(n.definition) "
+     "WITH n, apoc.convert.fromJsonMap(n.definition[0]) AS def WHERE EXISTS(def.value)",
+     "SET n.description = [def.value]", ["n", "def"]),
+    ("MATCH (n) WHERE n.label = 'SET x' SET n.label = 'MERGE'",
+     "MATCH (n) WHERE n.label = 'SET x'", "SET n.label = 'MERGE'", ["n"]),
+    ("MATCH (n) WHERE EXISTS(n.uniqueFacets) AND NOT SIZE(apoc.coll.toSet(n.uniqueFacets)) = SIZE(n.uniqueFacets) "
+     "SET n.uniqueFacets = apoc.coll.toSet(n.uniqueFacets)",
+     "MATCH (n) WHERE EXISTS(n.uniqueFacets) AND NOT SIZE(apoc.coll.toSet(n.uniqueFacets)) = SIZE(n.uniqueFacets)",
+     "SET n.uniqueFacets = apoc.coll.toSet(n.uniqueFacets)", ["n"]),
+])
+def test_split_update_accepts(statement, read, update, variables):
+    assert split_update(statement) == (read, update, variables)
+
+
+@pytest.mark.parametrize("statement", [
+    "MERGE (p:pub {short_form:'Unattributed'}) SET p:Entity",
+    "MATCH (a)-[r1:licence]->(l:License) MERGE (a)-[r2:has_license]->(l) SET r2.label='has_license' DELETE r1",
+    "MATCH (a:NBLAST) REMOVE a:NBLAST",
+    "MATCH (n) WITH COUNT(n) AS total MATCH (m) SET m.total = total",
+    "MATCH (n) WHERE EXISTS(n.x) SET n.x = 1 WITH n MATCH (n)-->(m) SET m.y = 1",
+    "MATCH p=(n)-->(m) SET m.len = length(p)",
+    "MATCH (a), p = (a)-->(m) SET m.len = length(p)",
+    "MATCH (n) RETURN n",
+    "MATCH (n) SET n.x = 1 RETURN n",
+])
+def test_split_update_rejects(statement):
+    assert split_update(statement) is None
+
+
+@pytest.mark.parametrize("statement, variables", [
+    ("MATCH (n:Deprecated) WHERE EXISTS(n.term_replaced_by) WITH n, REPLACE(n.term_replaced_by[0], ':', '_') AS id "
+     "MATCH (r {short_form: id}) MERGE (n)-[t:term_replaced_by]->(r)", ["n", "r"]),
+    ("MATCH (n:Class) WHERE n.label STARTS WITH 'wiki' AND NOT n:Gene SET n:Gene", ["n"]),
+    ("MATCH (a)-[r]->(b) WITH * WHERE EXISTS(r.x) SET b.y = 1", ["b"]),
+    ("MATCH (a)-[r]->(b) WITH a AS c WHERE EXISTS(c.x) SET c.y = 1", ["c"]),
+    ("MATCH (n) WITH n, [x IN n.list | x.value] AS values FOREACH (v IN values | SET n.seen = v)", ["n", "values"]),
+])
+def test_split_writes(statement, variables):
+    assert split_writes(statement)[1] == variables
+
+
+def test_split_writes_synonym_edges():
+    from apply_synonym_edges import q
+    assert split_writes(q)[1] == ["primary", "syn", "resolved_pub", "unresolved", "unresolved_ref"]
+
+
+def test_split_writes_load_csv():
+    from finalStep import nblast_load_statement
+    read, variables = split_writes(nblast_load_statement("scores.tsv"))
+    assert variables == ["s", "b", "r", "score"]
+    assert read.endswith("OR NOT (s:NBLAST AND b:NBLAST)")
+
+
+@pytest.mark.parametrize("statement, deleted", [
+    ("MATCH (i:Individual) WHERE i.label = i.short_form DETACH DELETE i", ["i"]),
+    ("MATCH (a)-[r]->(b) detach delete a, b", ["a", "b"]),
+    ("MATCH (a)-[r]->(b) DELETE r", []),
+    ("MATCH (n) WHERE n.label = 'DETACH DELETE x' SET n:Other", []),
+])
+def test_detach_deleted(statement, deleted):
+    assert detach_deleted(statement) == deleted
+
+
+@pytest.mark.parametrize("statement, writes", [
+    ("MERGE (p:pub {short_form:'Unattributed'})", True),
+    ("CALL apoc.create.addLabels(n, ['Other'])", True),
+    ("MATCH (n) SET n:Other", True),
+    ("MATCH (n) WHERE n.label = 'SET' RETURN n", False),
+])
+def test_may_write(statement, writes):
+    assert may_write(statement) == writes
+
+
+def test_run_statements_batch(fake_connection):
+    nc = fake_connection()
+    assert run_statements(nc, [
+        "MATCH (n:Class) WHERE n.short_form STARTS WITH 'FBgn' AND NOT n:Gene SET n:Gene",
+        "MATCH (n) WHERE EXISTS(n.uniqueFacets) SET n.uniqueFacets = apoc.coll.toSet(n.uniqueFacets)",
+    ], batch=True)
+    assert nc.calls == [
+        ["CALL apoc.periodic.iterate(\"MATCH (n:Class) WHERE n.short_form STARTS WITH 'FBgn' AND NOT n:Gene "
+         "RETURN DISTINCT n\", \"SET n:Gene\", {batchSize: 10000, parallel: false, retries: 3}) "
+         "YIELD batches, total, failedBatches, errorMessages RETURN batches, total, failedBatches, errorMessages"],
+        ["CALL apoc.periodic.iterate(\"MATCH (n) WHERE EXISTS(n.uniqueFacets) RETURN DISTINCT n\", "
+         "\"SET n.uniqueFacets = apoc.coll.toSet(n.uniqueFacets)\", {batchSize: 10000, parallel: false, retries: 3}) "
+         "YIELD batches, total, failedBatches, errorMessages RETURN batches, total, failedBatches, errorMessages"],
+    ]
+
+
+def test_run_statements_batch_rejects_before_committing(fake_connection):
+    nc = fake_connection()
+    with pytest.raises(ValueError):
+        run_statements(nc, ["MATCH (n:Thing) WHERE NOT n:Other SET n:Other", "MATCH (a:NBLAST) REMOVE a:NBLAST"],
+                       batch=True)
+    assert nc.calls == []
+
+
+def test_run_statements_unbatched(fake_connection):
+    nc = fake_connection()
+    statements = ["MATCH (n:Class) WHERE n.short_form STARTS WITH 'FBgn' SET n:Gene", "MATCH (a:NBLAST) REMOVE a:NBLAST"]
+    assert run_statements(nc, statements)
+    assert nc.calls == [statements]
+
+
+def test_partition_rounds():
+    rounds = partition_rounds(6)
+    pairs = [tuple(sorted(pair)) for round_pairs in rounds for pair in round_pairs]
+    assert sorted(pairs) == [(i, j) for i in range(6) for j in range(i, 6)]
+    for round_pairs in rounds:
+        classes = [c for pair in round_pairs for c in set(pair)]
+        assert len(classes) == len(set(classes))
+
+
+def test_run_partitioned_partitions_on_the_server(fake_connection):
+    nc = fake_connection()
+    assert run_partitioned(nc, "MATCH (a)<-[r1:RO_0002292]-(b)", "a, b, r1", "DELETE r1", ("a", "b"), 2)
+    statements = [call[0] for call in nc.calls]
+    assert len(statements) == 10
+    read = ("\"MATCH (a)<-[r1:RO_0002292]-(b) WITH DISTINCT a, b, r1 "
+            "WHERE [id(a) % $classes, id(b) % $classes] IN [[$i, $j], [$j, $i]] RETURN a, b, r1\"")
+    assert all(statement.startswith("CALL apoc.periodic.iterate(" + read) for statement in statements)
+    pairs = sorted(tuple(int(n) for n in re.search(r"i: (\d+), j: (\d+)", statement).groups())
+                   for statement in statements)
+    assert pairs == [(i, j) for i in range(4) for j in range(i, 4)]
+    assert all("params: {classes: 4, " in statement for statement in statements)
+
+
+def test_run_partitioned_single_node(fake_connection):
+    nc = fake_connection()
+    assert run_partitioned(nc, "MATCH (n)-[r]->(s:Site)", "n, r", "SET r.x = 1", ("n",), 2)
+    assert len(nc.calls) == 4
+    assert all("WITH DISTINCT n, r WHERE id(n) % $classes = $i RETURN n, r" in call[0] for call in nc.calls)
+
+
+def test_run_partitioned_reruns_only_deadlocked_jobs(fake_connection):
+    nc = fake_connection(deadlocked=["i: 2, j: 2"])
+    assert run_partitioned(nc, "MATCH (a)<-[r1:RO_0002292]-(b)", "a, b, r1", "DELETE r1", ("a", "b"), 2)
+    assert len(nc.calls) == 11
+    assert "i: 2, j: 2" in nc.calls[-1][0]
+    assert "parallel: false" in nc.calls[-1][0]
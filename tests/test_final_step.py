@@ -0,0 +1,49 @@
+import pytest
+
+import finalStep
+
+
+@pytest.fixture(params=["number", "list"])
+def score_format(request, monkeypatch):
+    monkeypatch.setitem(finalStep.pipeline.options, 'score_format', request.param)
+    return request.param
+
+
+def test_score_expressions(score_format):
+    if score_format == "list":
+        assert finalStep.score_value("score") == "[score]"
+        assert finalStep.score_of("r1") == "r1.NBLAST_score[0]"
+    else:
+        assert finalStep.score_value("score") == "score"
+        assert finalStep.score_of("r1", "neuronbridge_score") == "r1.neuronbridge_score"
+
+
+def test_nblast_load_statement(score_format):
+    statement = finalStep.nblast_load_statement("scores.tsv", label="NBLASTexp")
+    value = "[score]" if score_format == "list" else "score"
+    assert "WITH s, b, toFloat(row.score) as score" in statement
+    assert f"NBLAST_score: {value}\n" in statement
+    assert f"SET r.NBLAST_score = {value}\n" in statement
+    assert f"WHERE r IS NULL OR NOT r.NBLAST_score = {value} OR NOT (s:NBLASTexp AND b:NBLASTexp)" in statement
+
+
+def test_score_format_option(monkeypatch):
+    monkeypatch.setattr(finalStep.pipeline, 'run', lambda steps: [])
+    assert finalStep.pipeline.main(["--score-format", "list"]) == 0
+    assert finalStep.score_as_list()
+    assert finalStep.pipeline.main([]) == 0
+    assert not finalStep.score_as_list()
+
+
+def test_convert_scores_is_optional():
+    names = [step.name for step in finalStep.pipeline.select()]
+    assert "convert_scores" not in names
+    assert [step.name for step in finalStep.pipeline.select(["convert_scores"])] == ["convert_scores"]
+
+
+def test_synonym_edge_changes_compare_the_resolved_pub():
+    from run_synonym_edges import synonym_edge_changes
+    for read in synonym_edge_changes():
+        assert "OPTIONAL MATCH (p:pub {short_form: pub_short_form})" in read
+        assert "(:pub {short_form: target})" in read
+        assert read.endswith("WITH DISTINCT primary")
@@ -0,0 +1,89 @@
+import re
+
+import pytest
+
+from normalization import (RELATIONSHIP_RULES, fused_statement, group_match, group_rules, normalize_relationships,
+                           score_rules)
+
+
+def rule(name, types, prop, creates=False):
+    return {"name": name, "types": types, "properties": [prop] if prop else [], "where": "NOT r.%s = 1" % prop,
+            "update": "SET r.%s = 1" % prop, "creates": creates}
+
+
+def test_group_rules_keeps_declaration_order():
+    rules = [rule("a", None, "a"), rule("b", ["y", "x"], "b"), rule("c", None, "c"), rule("d", ["x", "y"], "d")]
+    assert [(types, [r["name"] for r in group]) for types, group in group_rules(rules)] == [
+        (None, ["a", "c"]), (("x", "y"), ["b", "d"])]
+
+
+def test_group_match():
+    assert group_match(("x", "y"), [rule("a", ["x", "y"], "a")]) == \
+        "MATCH (s)-[r:x|y]->(e) WHERE EXISTS(r.a) AND NOT r.a = 1"
+    assert group_match(None, [rule("a", None, "a"), rule("b", None, "b")]) == \
+        "MATCH (s)-[r]->(e) WHERE (EXISTS(r.a) AND NOT r.a = 1) OR (EXISTS(r.b) AND NOT r.b = 1)"
+
+
+def test_group_match_without_properties():
+    licence = [r for r in RELATIONSHIP_RULES if r["name"] == "licence to has_license"]
+    assert group_match(("licence",), licence) == "MATCH (s)-[r:licence]->(e) WHERE e:License"
+
+
+def test_fused_statement_single_rule():
+    statement = fused_statement(("x",), [rule("a", ["x"], "a")], batch_size=100)
+    assert statement.startswith(
+        "CALL apoc.periodic.iterate(\"MATCH (s)-[r:x]->(e) WHERE EXISTS(r.a) AND NOT r.a = 1 RETURN s, r, e\", "
+        "\"SET r.a = 1\", {batchSize: 100, parallel: false, retries: 3})")
+
+
+def test_fused_statement_guards_each_rule():
+    statement = fused_statement(None, [rule("a", None, "a"), rule("b", None, "b")])
+    assert ("\"FOREACH (_ IN CASE WHEN EXISTS(r.a) AND NOT r.a = 1 THEN [1] ELSE [] END | SET r.a = 1) "
+            "FOREACH (_ IN CASE WHEN EXISTS(r.b) AND NOT r.b = 1 THEN [1] ELSE [] END | SET r.b = 1)\"") in statement
+
+
+def test_fused_statement_inlines_params():
+    statement = fused_statement(("x",), [rule("a", ["x"], "a")], params={"maxBeforeDecimal": 2, "unit": "um"})
+    assert "{batchSize: 10000, parallel: false, retries: 3, params: {maxBeforeDecimal: 2, unit: \"um\"}}" in statement
+
+
+def test_normalize_relationships_prepares_and_captures(fake_connection):
+    nc = fake_connection(answers={"AS maxBeforeDecimal": (['maxBeforeDecimal', 'maxAfterDecimal'], [2, 3])})
+    captured = []
+    assert normalize_relationships(nc, capture=lambda read, variables, params: captured.append((variables, params)))
+    assert [variables for variables, _ in captured] == [["r"], ["s", "r", "e"], ["r"]]
+    assert captured[2][1] == {"maxBeforeDecimal": 2, "maxAfterDecimal": 3}
+    assert "params: {maxBeforeDecimal: 2, maxAfterDecimal: 3}" in nc.statements[-1]
+
+
+@pytest.mark.parametrize("as_list, value", [
+    (False, "toFloat(apoc.coll.flatten([r.NBLAST_score])[0])"),
+    (True, "[toFloat(apoc.coll.flatten([r.NBLAST_score])[0])]"),
+])
+def test_score_rules(as_list, value):
+    nblast, neuronbridge = score_rules(as_list=as_list)
+    assert nblast["properties"] == ["NBLAST_score"]
+    assert nblast["where"] == "NOT r.NBLAST_score = " + value
+    assert nblast["update"] == "SET r.NBLAST_score = " + value
+    assert neuronbridge["update"] == "SET r.neuronbridge_score = " + value.replace("NBLAST", "neuronbridge")
+    assert [types for types, _ in group_rules([nblast, neuronbridge])] == [
+        ("has_similar_morphology_to", "has_similar_morphology_to_part_of")]
+
+
+def converted(value, stored):
+    """Evaluate a score_rules value expression the way Cypher does, for a stored score."""
+    match = re.fullmatch(r"(\[)?toFloat\(apoc\.coll\.flatten\(\[r\.\w+\]\)\[0\]\)(\])?", value)
+    assert match, value
+    flattened = stored if isinstance(stored, list) else [stored]
+    number = float(flattened[0])
+    return [number] if match.group(1) else number
+
+
+@pytest.mark.parametrize("stored", ["0.5", ["0.5"], 0.5, [0.5]])
+@pytest.mark.parametrize("as_list", [False, True])
+def test_score_rules_convert_every_stored_form(stored, as_list):
+    value = score_rules(as_list=as_list)[0]["update"].split(" = ", 1)[1]
+    result = converted(value, stored)
+    assert result == ([0.5] if as_list else 0.5)
+    # Once converted the rule's 'where' no longer matches, so a rerun skips the edge
+    assert converted(value, result) == result
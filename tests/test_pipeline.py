@@ -0,0 +1,42 @@
+STEPS = [
+    ("works", ["MATCH (n) RETURN n"]),
+    ("fails", ["MATCH (n) WHERE n.label = 'fail' REMOVE n:Thing", "MATCH (n) RETURN n"]),
+    ("batch_fails", ["MATCH (n:Thing) WHERE n.label = 'fail' SET n:Other"], {"batch": True}),
+    ("migration", ["MATCH (n:Thing) SET n:Migrated"], {"optional": True}),
+]
+
+
+def test_select(fake_connection, make_pipeline):
+    pipeline = make_pipeline(fake_connection(), STEPS)
+    assert [step.name for step in pipeline.select(["fails", "1"])] == ["works", "fails"]
+    assert [step.name for step in pipeline.select(start="2")] == ["fails", "batch_fails"]
+    assert [step.name for step in pipeline.select(until="fails")] == ["works", "fails"]
+    assert [step.name for step in pipeline.select(["migration"])] == ["migration"]
+
+
+def test_main_reports_failed_steps(fake_connection, make_pipeline, capsys):
+    nc = fake_connection(fail_on="fail")
+    pipeline = make_pipeline(nc, STEPS)
+    assert pipeline.main([]) == 1
+    assert pipeline.failed == ["fails", "batch_fails"]
+    assert "Failed steps: fails, batch_fails; rerun them with --only fails,batch_fails" in capsys.readouterr().out
+    assert not any("Migrated" in statement for statement in nc.statements)
+
+
+def test_main_succeeds(fake_connection, make_pipeline):
+    pipeline = make_pipeline(fake_connection(fail_on="fail"), STEPS)
+    assert pipeline.main(["--only", "works,migration"]) == 0
+    assert pipeline.failed == []
+
+
+def test_dry_run_never_connects(make_pipeline):
+    pipeline = make_pipeline(None, STEPS)
+    assert pipeline.main(["--dry-run"]) == 0
+
+
+def test_add_option(make_pipeline):
+    pipeline = make_pipeline(None, [])
+    pipeline.add_option('--unit', choices=['um', 'nm'], default='um')
+    assert pipeline.options == {'unit': 'um'}
+    assert pipeline.main(["--unit", "nm"]) == 0
+    assert pipeline.options == {'unit': 'nm'}